@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+"""Benchmarks for the Qibla-Numa calculations in try.py.
+
+Usage: python3 bench.py [prayer] [cities] [location] [startup] [timetable] [fleet] [ephemeris] [resolver] [grid] [crossings] [regression] [--days N] [--cities N]
+       [--baseline FILE] [--update-baseline] [--tolerance X]
+"""
+
+import argparse
+import http.server
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+qn = importlib.import_module("try")  # 'try' is a keyword, so the script cannot be imported with a plain import statement
+
+def bench_prayer_batch(days):
+    """Times LocalPrayerCalculator against BatchPrayerCalculator over the bundled cities x days and checks they agree."""
+    start, store = datetime(2025, 1, 1, 12, tzinfo=pytz.utc), qn.get_city_store()
+    dates = [start + timedelta(days=d) for d in range(days)]
+    lats, lons = np.asarray(store.lat), np.asarray(store.lon)
+
+    t = time.perf_counter()
+    scalar = [[qn.LocalPrayerCalculator(lat, lon, "UTC", qn.MADHAB, 18.0, 18.0).calculate_times_for_date(d) for d in dates] for lat, lon in zip(lats.tolist(), lons.tolist())]
+    scalar_s = time.perf_counter() - t
+
+    t = time.perf_counter()
+    batch = qn.BatchPrayerCalculator(lats[:, None], lons[:, None], qn.MADHAB, 18.0, 18.0).calculate_times(np.array(dates, dtype=object)[None, :])
+    batch_s = time.perf_counter() - t
+
+    worst, mismatched = 0.0, 0
+    for key in qn.PRAYER_KEYS:
+        expected = np.array([[r[key].timestamp() if r[key] else np.nan for r in row] for row in scalar])
+        mismatched += int(np.count_nonzero(np.isnan(expected) == batch[f"{key}_valid"]))
+        both = ~np.isnan(expected) & batch[f"{key}_valid"]
+        worst = max(worst, float(np.max(np.abs(expected[both] - batch[key][both]), initial=0.0)))
+
+    rows = lats.size * days
+    print(f"prayer times: {lats.size} locations x {days} days = {rows} rows")
+    print(f"  scalar : {scalar_s:8.3f} s  ({rows / scalar_s:,.0f} rows/s)")
+    print(f"  batch  : {batch_s:8.3f} s  ({rows / batch_s:,.0f} rows/s, {scalar_s / batch_s:.0f}x)")
+    print(f"  max |scalar - batch| = {worst:.3f} s, validity mismatches = {mismatched}")
+    return worst < 1.0 and mismatched == 0
+
+def bench_city_index(n_cities, queries=200):
+    """Times the CityStore (build, save, memory-mapped load, name lookup) and CityIndex queries against a linear haversine
+    scan on a synthetic gazetteer of n_cities."""
+    rng = np.random.default_rng(0)
+    lats, lons, pops = np.degrees(np.arcsin(rng.uniform(-1, 1, n_cities))), rng.uniform(-180, 180, n_cities), rng.integers(1000, 10**7, n_cities)
+    cities = [(f"City {i}", f"Country {i % 200}", float(la), float(lo), int(p)) for i, (la, lo, p) in enumerate(zip(lats, lons, pops))]
+    points = list(zip(rng.uniform(-80, 80, queries), rng.uniform(-180, 180, queries)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cities.qnc")
+        t = time.perf_counter(); built = qn.CityStore.from_rows(cities); store_s = time.perf_counter() - t
+        # Saved with its k-d tree, as --build-city-store writes it, so CityIndex(store) below only memory-maps the tree.
+        t = time.perf_counter(); built = qn.CityStore({**built.columns, **qn.CityIndex(built).tree_columns()}); build_s = time.perf_counter() - t
+        t = time.perf_counter(); built.save(path); store_s += time.perf_counter() - t; del built
+        t = time.perf_counter(); store = qn.CityStore.load(path); load_s = time.perf_counter() - t
+        t = time.perf_counter(); found = [store.find(*cities[i][:2]) for i in range(0, n_cities, max(n_cities // queries, 1))]; find_s = (time.perf_counter() - t) / len(found)
+        agree = found == list(range(0, n_cities, max(n_cities // queries, 1)))
+        t = time.perf_counter(); index = qn.CityIndex(store); open_s = time.perf_counter() - t
+        timings = {}
+        for name, query in (("nearest", lambda la, lo: index.nearest(la, lo)[0][0]), ("most_influential", lambda la, lo: index.most_influential(la, lo)),
+                            ("within 500 km", lambda la, lo: index.within(la, lo, 500))):
+            t = time.perf_counter()
+            for la, lo in points: query(la, lo)
+            timings[name] = (time.perf_counter() - t) / queries
+        t = time.perf_counter()
+        for la, lo in points[:10]:
+            agree &= min(cities, key=lambda c: qn.haversine_km(la, lo, c[2], c[3])) == index.nearest(la, lo)[0][0]
+        linear_s = (time.perf_counter() - t) / 10
+
+        print(f"city store: {n_cities} cities, {os.path.getsize(path) / 1e6:.1f} MB file; build+save {store_s:.2f} s, memory-mapped load {load_s * 1e3:.2f} ms, find {find_s * 1e6:.1f} us")
+        print(f"city index: build {build_s:.2f} s (once, into the store), open from the store {open_s * 1e3:.2f} ms")
+        for name, seconds in timings.items(): print(f"  {name:<17}: {seconds * 1e3:8.3f} ms/query")
+        print(f"  {'linear nearest':<17}: {linear_s * 1e3:8.3f} ms/query  (index and lookups agree: {agree})")
+        del store, index
+    return agree
+
+def bench_location_cache(repeats=5):
+    """Times location resolution on a cold cache (fresh file, no TimezoneFinder yet) against a warm one, as a new launch sees it."""
+    lookups = {"coords": lambda: qn.get_location_by_coords(46.73, -117.0), "bundled city": lambda: qn.get_location_by_address("Cairo", "", "Egypt")}
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"location cache: {repeats} launches per case")
+        for name, lookup in lookups.items():
+            path, timings = os.path.join(tmp, name.replace(" ", "_") + ".sqlite3"), {}
+            for state in ("cold", "warm"):
+                total = 0.0
+                for _ in range(repeats):
+                    if state == "cold" and os.path.exists(path): os.remove(path)
+                    qn.LOCATION_CACHE = qn.LocationCache(path, qn.LOCATION_CACHE_TTL_DAYS * 86400, qn.LOCATION_CACHE_MAX_ENTRIES)
+                    qn.get_timezone_finder.cache_clear()
+                    t = time.perf_counter(); result = lookup(); total += time.perf_counter() - t
+                timings[state] = total / repeats
+            print(f"  {name:<13}: cold {timings['cold'] * 1e3:7.2f} ms, warm {timings['warm'] * 1e3:7.2f} ms  ({result['timezone']})")
+    return True
+
+def bench_startup(repeats=7):
+    """Times fresh interpreters: bare, importing try.py, the --prayers report for coordinates, a bundled city and a
+    cached address, and the imports try.py now defers."""
+    here, tmp = os.path.dirname(os.path.abspath(__file__)), tempfile.mkdtemp()
+    prelude = f"import sys, importlib; sys.path.insert(0, {here!r}); qn = importlib.import_module('try'); "
+    # Every report reads a private cache seeded as a second launch would find it, and never touches the user's
+    # report state file, which would also put its reads and writes in the timings.
+    cache = qn.LocationCache(os.path.join(tmp, "cache.sqlite3"), 3600, 100)
+    cache.put(f"address:{qn.normalize_address('Moscow', 'Idaho', 'USA')}", {"latitude": 46.73, "longitude": -117.0, "timezone": "America/Los_Angeles", "address": "Moscow, Idaho, USA"})
+    cache.put("tz:30.0444,31.2357", "Africa/Cairo"); cache.put("tz:46.7300,-117.0000", "America/Los_Angeles")
+    isolated = prelude + f"qn.LOCATION_CACHE = qn.LocationCache({cache.path!r}, 3600, 100); qn.REPORT_STATE_FILE = ''; "
+    address = isolated + "qn.LATITUDE = qn.LONGITUDE = ''; "
+    prayers = "sys.argv = ['try.py', '--prayers']; qn.main()"
+    cases = {
+        "bare interpreter": "pass",
+        "import try": prelude,
+        "--prayers, coordinates": isolated + "qn.LATITUDE, qn.LONGITUDE = 46.73, -117.0; " + prayers,
+        "--prayers, bundled city": address + "qn.CITY, qn.STATE, qn.COUNTRY = 'Cairo', '', 'Egypt'; " + prayers,
+        "--prayers, cached address": address + "qn.CITY, qn.STATE, qn.COUNTRY = 'Moscow', 'Idaho', 'USA'; " + prayers,
+        "deferred imports": "import numpy, requests, skyfield.api, skyfield.almanac, geopy.geocoders, timezonefinder",
+    }
+    subprocess.run([sys.executable, "-c", prelude], check=True)  # make sure try.py's bytecode is cached
+    print(f"startup: median of {repeats} fresh interpreters")
+    for name, code in cases.items():
+        runs = []
+        for _ in range(repeats):
+            t = time.perf_counter(); subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.DEVNULL); runs.append(time.perf_counter() - t)
+        print(f"  {name:<26}: {sorted(runs)[repeats // 2] * 1e3:7.1f} ms")
+    shutil.rmtree(tmp)
+    return True
+
+def open_ephemeris():
+    """EPHEMERIS_FILE opened with load_file only, or None when it is missing; never qn.load_ephemeris(), which would
+    download de421 and take an offline suite to the network."""
+    return qn.skyfield_api.load_file(qn.EPHEMERIS_FILE) if os.path.exists(qn.EPHEMERIS_FILE) else None
+
+def bench_timetable(days, sample_days=14):
+    """Streams a timetable of `days` days to /dev/null and compares it with per-day searches over the first sample_days."""
+    eph, ts = open_ephemeris(), qn.skyfield_api.load.timescale()
+    if eph is None: print(f"timetable: {qn.EPHEMERIS_FILE} not found, skipped"); return True
+    location = {"latitude": 46.73, "longitude": -117.0, "timezone": "America/Los_Angeles"}
+    tz, observer, start = qn.get_timezone(location["timezone"]), qn.skyfield_api.wgs84.latlon(46.73, -117.0), datetime(2025, 1, 1).date()
+
+    t = time.perf_counter()
+    with open(os.devnull, "w") as out: rows = qn.write_timetable(qn.iter_timetable(location, eph, ts, start, start + timedelta(days=days - 1)), out, "jsonl")
+    streamed_s = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for d in (start + timedelta(days=i) for i in range(sample_days)):
+        qn.calculate_moon_mysteries(eph, observer, ts, ts.from_datetime(tz.localize(datetime.combine(d, datetime.min.time()))), tz, own_day=True); qn.calculate_inland_tides(eph, observer, ts, d, tz)
+    per_day_s = (time.perf_counter() - t) / sample_days
+
+    print(f"timetable: {rows} days")
+    print(f"  streamed : {streamed_s:8.3f} s  ({streamed_s / rows * 1e3:.1f} ms/day)")
+    print(f"  per day  : {per_day_s * rows:8.3f} s  ({per_day_s * 1e3:.1f} ms/day, extrapolated from {sample_days} days, {per_day_s * rows / streamed_s:.1f}x)")
+    return rows == days
+
+def bench_fleet(n_sites=48, interval=0.2):
+    """Times run_fleet over bundled cities with 1, 2, 4, ... workers up to the CPU count and reports the scaling, then
+    checks that city rows needing the geocoder are fetched once per address, `interval` apart, against a stub server."""
+    # The workers' initializer calls qn.load_ephemeris(), which would download a missing kernel.
+    if not os.path.exists(qn.EPHEMERIS_FILE): print(f"fleet: {qn.EPHEMERIS_FILE} not found, skipped"); return True
+    cities = [qn.get_city_store()[i] for i in range(n_sites)]
+    sites = [{"name": c.name, "latitude": c.latitude, "longitude": c.longitude, "timezone": qn.timezone_at(c.latitude, c.longitude)} for c in cities]
+    now, counts, base = datetime.now(pytz.utc), sorted({min(2 ** i, os.cpu_count()) for i in range(8)}), None
+    print(f"fleet: {len(sites)} sites, {os.cpu_count()} CPUs")
+    for workers in counts:
+        with open(os.devnull, "w") as out: done, elapsed = qn.run_fleet(sites, out, now, workers)
+        base = base or done / elapsed
+        print(f"  {workers:3d} workers: {elapsed:7.2f} s  ({done / elapsed:6.1f} locations/s, {done / elapsed / base:.1f}x)")
+    ok = done == len(sites)
+
+    server = _StubLocationServer(); threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.behaviour = {"/search": (0.0, 200)}
+    saved = (qn.GEOCODER_URL, qn.GEOCODER_MIN_INTERVAL, qn.LOCATION_CACHE)
+    addresses = [(f"Testville {i}", "Nowhere", "Atlantis") for i in range(3)]
+    sites = [{"city": city, "state": state, "country": country} for _ in range(4) for city, state, country in addresses]
+    out = io.StringIO()
+    with tempfile.TemporaryDirectory() as tmp:
+        qn.GEOCODER_URL, qn.GEOCODER_MIN_INTERVAL = f"http://127.0.0.1:{server.server_address[1]}", interval
+        qn.LOCATION_CACHE = qn.LocationCache(os.path.join(tmp, "cache.sqlite3"), 3600, 100)
+        try: done, elapsed = qn.run_fleet(sites, out, now, 4)
+        finally: qn.GEOCODER_URL, qn.GEOCODER_MIN_INTERVAL, qn.LOCATION_CACHE = saved; server.shutdown()
+    errors = sum("error" in json.loads(line) for line in out.getvalue().splitlines())
+    times = [t for t, path in server.requests if path == "/search"]
+    gap = min((b - a for a, b in zip(times, times[1:])), default=interval)
+    passed = done == len(sites) and not errors and len(times) == len(addresses) and gap >= interval * 0.95
+    print(f"  geocoded in parent: {'ok  ' if passed else 'FAIL'} {len(sites)} sites, {len(times)} geocoder requests for {len(addresses)} addresses, "
+          f"min gap {gap * 1e3:.0f} ms, {errors} errors, {elapsed:.2f} s")
+    return ok and passed
+
+def _ephemeris_probe(path):
+    """Runs in a fresh spawned interpreter: opens the kernel at path, computes one report, and returns
+    (load ms, peak RSS kB, resident kB of the kernel's mapping)."""
+    ts = qn.skyfield_api.load.timescale()
+    t = time.perf_counter(); eph = qn.skyfield_api.load_file(path); load_ms = (time.perf_counter() - t) * 1e3
+    location = {"latitude": 46.73, "longitude": -117.0, "timezone": "America/Los_Angeles"}
+    qn.compute_events(location, eph, ts, datetime.now(qn.get_timezone(location["timezone"])))
+    resident, mapping = 0, None
+    with open("/proc/self/smaps") as smaps:
+        for fields in map(str.split, smaps):
+            if not fields[0].endswith(":"): mapping = fields[-1]  # a mapping header; its last field is the mapped path
+            elif fields[0] == "Rss:" and mapping == path: resident += int(fields[1])
+    return load_ms, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resident
+
+def bench_ephemeris(repeats=5):
+    """Compares EPHEMERIS_FILE with a subset of it in fresh interpreters: load time, peak RSS and resident kernel pages after one report."""
+    if not os.path.exists(qn.EPHEMERIS_FILE): print(f"ephemeris: {qn.EPHEMERIS_FILE} not found, skipped"); return True
+    year, spawn = datetime.now().year, multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        subset = os.path.join(tmp, "subset.bsp")
+        qn.extract_ephemeris(qn.EPHEMERIS_FILE, subset, year - 1, year + 30)
+        print(f"ephemeris: median of {repeats} fresh interpreters, one report each (Linux /proc for resident pages)")
+        for label, path in ((qn.EPHEMERIS_FILE, os.path.abspath(qn.EPHEMERIS_FILE)), (f"subset {year - 1}-{year + 30}", subset)):
+            runs = []
+            for _ in range(repeats):
+                with spawn.Pool(1) as pool: runs.append(pool.apply(_ephemeris_probe, (path,)))
+            load_ms, peak_kb, resident_kb = (sorted(column)[repeats // 2] for column in zip(*runs))
+            print(f"  {label:<20}: {os.path.getsize(path) / 1e6:5.1f} MB file, load {load_ms:5.1f} ms, peak RSS {peak_kb / 1024:6.1f} MB, kernel resident {resident_kb / 1024:5.1f} MB")
+    return True
+
+class _CountingTimescale:
+    """Passes tt_jd through to a skyfield Timescale, counting the instants asked for."""
+    def __init__(self, ts): self.ts, self.points = ts, 0
+    def tt_jd(self, jd): self.points += int(np.size(jd)); return self.ts.tt_jd(jd)
+
+def bench_crossings(days=4):
+    """Compares find_altitude_crossings with find_discrete at the old fixed 0.05-day step for the Moon at 45° and the
+    Sun at -18° over the regression sites and dates: time, altitudes evaluated, and error against a 0.005-day search."""
+    eph, ts = open_ephemeris(), qn.skyfield_api.load.timescale()
+    if eph is None: print(f"crossings: {qn.EPHEMERIS_FILE} not found, skipped"); return True
+    ok = True
+    print(f"crossings: {len(REGRESSION_SITES)} sites x {len(REGRESSION_DATES)} dates, {days}-day windows")
+    for body, threshold in (("moon", 45.0), ("sun", -18.0)):
+        totals = {"fixed": [0.0, 0, 0.0, 0], "adaptive": [0.0, 0, 0.0, 0]}  # seconds, points, worst error s, count mismatches
+        for _, lat, lon, _ in REGRESSION_SITES:
+            observer = qn.skyfield_api.wgs84.latlon(lat, lon)
+            topos = eph['earth'] + observer
+            for y, m, d in REGRESSION_DATES:
+                start, end = ts.utc(y, m, d), ts.utc(y, m, d + days)
+                def above(t):
+                    above.points += t.tt.size
+                    return topos.at(t).observe(eph[body]).apparent().altaz()[0].degrees > threshold
+                above.points, above.step_days = 0, 0.005
+                reference, _ = qn.almanac.find_discrete(start, end, above)
+                above.points, above.step_days = 0, 0.05
+                t0 = time.perf_counter(); fixed, _ = qn.almanac.find_discrete(start, end, above); fixed_s = time.perf_counter() - t0
+                counting = _CountingTimescale(ts)
+                t0 = time.perf_counter(); adaptive, _ = qn.find_altitude_crossings(eph, body, observer, counting, start, end, threshold); adaptive_s = time.perf_counter() - t0
+                for label, found, seconds, points in (("fixed", fixed, fixed_s, above.points), ("adaptive", adaptive, adaptive_s, counting.points)):
+                    row = totals[label]; row[0] += seconds; row[1] += points
+                    if len(found) != len(reference): row[3] += 1
+                    else: row[2] = max(row[2], float(np.max(np.abs(found.tt - reference.tt), initial=0.0)) * 86400)
+        print(f"  {body} at {threshold:+.0f}°:")
+        for label, (seconds, points, worst, mismatched) in totals.items():
+            print(f"    {label:<8}: {seconds * 1e3:8.1f} ms, {points:6d} altitudes evaluated, max error {worst:.3f} s, {mismatched} windows with a different number of crossings")
+        ok = ok and totals["adaptive"][3] == 0 and totals["adaptive"][2] < 1.0
+    return ok
+
+def bench_grid(resolution=0.25, samples=200):
+    """Times compute_global_grid for one instant into a memory-mapped .npy and checks sampled cells against the scalar
+    prayer calculator and skyfield's topocentric Moon altitude and hour angle."""
+    eph, ts = open_ephemeris(), qn.skyfield_api.load.timescale()
+    if eph is None: print(f"grid: {qn.EPHEMERIS_FILE} not found, skipped"); return True
+    t = ts.utc(2025, 6, 21, 7, 30)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "grid.npy")
+        start = time.perf_counter()
+        grid = qn.compute_global_grid(eph, ts, t, path, resolution)
+        elapsed, size = time.perf_counter() - start, os.path.getsize(path)
+        grid = np.load(path, mmap_mode="r")
+        lats, lons = qn.grid_centres(resolution)
+        rng, now = np.random.default_rng(0), t.utc_datetime()
+        worst = {"fajr": 0.0, "maghrib": 0.0, "moon altitude": 0.0, "tide phase": 0.0}
+        mismatched = 0
+        for i, j in zip(rng.integers(0, lats.size, samples), rng.integers(0, lons.size, samples)):
+            lat, lon, cell = float(lats[i]), float(lons[j]), grid[i, j]
+            calc = qn.LocalPrayerCalculator(lat, lon, "UTC", qn.MADHAB, qn.PRAYER_METHOD_ANGLES['fajr'], qn.PRAYER_METHOD_ANGLES['isha'])
+            days = [calc.calculate_times_for_date(now + timedelta(days=k)) for k in range(-1, 3)]
+            for key in ("fajr", "maghrib"):
+                expected = min((d[key].timestamp() for d in days if d[key] and d[key] > now), default=np.nan)
+                got = float(cell[f"next_{key}"])
+                if np.isnan(expected) != np.isnan(got): mismatched += 1
+                elif not np.isnan(got): worst[key] = max(worst[key], abs(got - expected))
+            position = (eph['earth'] + qn.skyfield_api.wgs84.latlon(lat, lon)).at(t).observe(eph['moon']).apparent()
+            worst["moon altitude"] = max(worst["moon altitude"], abs(float(cell["moon_altitude"]) - position.altaz()[0].degrees))
+            phase_error = (float(cell["tide_phase"]) - position.hadec()[0].hours % 12 / 12 + 0.5) % 1 - 0.5
+            worst["tide phase"] = max(worst["tide phase"], abs(phase_error))
+    print(f"grid: {lats.size} x {lons.size} cells at {resolution}°, {size / 1e6:.1f} MB")
+    print(f"  computed : {elapsed:8.3f} s  ({lats.size * lons.size / elapsed:,.0f} cells/s)")
+    print(f"  {samples} sampled cells: next Fajr/Maghrib max error {worst['fajr']:.3f}/{worst['maghrib']:.3f} s, existence mismatches {mismatched}")
+    print(f"  moon altitude max error {worst['moon altitude']:.3f}°, tide phase max error {worst['tide phase'] * 12.42 * 60:.1f} min of the cycle")
+    return worst["fajr"] < 1.0 and worst["maghrib"] < 1.0 and mismatched == 0 and worst["moon altitude"] < 0.25
+
+REGRESSION_SITES = (("Quito", -0.1807, -78.4678, "America/Guayaquil"), ("Singapore", 1.3521, 103.8198, "Asia/Singapore"),
+                    ("Moscow, Idaho", 46.73, -117.0, "America/Los_Angeles"), ("Cairo", 30.0444, 31.2357, "Africa/Cairo"),
+                    ("Tromso", 69.6492, 18.9553, "Europe/Oslo"), ("Longyearbyen", 78.2232, 15.6267, "Arctic/Longyearbyen"),
+                    ("McMurdo", -77.8419, 166.6863, "Antarctica/McMurdo"))
+REGRESSION_DATES = ((2025, 3, 20), (2025, 6, 21), (2025, 12, 21))  # equinox and both solstices: midnight sun and polar night up north
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+def regression_cases(eph, ts):
+    """One case per site and date, evaluated at local noon."""
+    for name, lat, lon, tz_name in REGRESSION_SITES:
+        tz = qn.get_timezone(tz_name)
+        for date in REGRESSION_DATES:
+            noon = tz.localize(datetime(*date, 12)); t = ts.from_datetime(noon)
+            yield {"label": f"{name} {noon.date()}", "lat": lat, "lon": lon, "tz": tz, "noon": noon, "t": t,
+                   "observer": qn.skyfield_api.wgs84.latlon(lat, lon), "moon_subpoint": qn.subpoint_of_body(eph, "moon", t),
+                   "calculator": qn.LocalPrayerCalculator(lat, lon, tz_name, qn.MADHAB, qn.PRAYER_METHOD_ANGLES["fajr"], qn.PRAYER_METHOD_ANGLES["isha"])}
+
+def reference_prayer_errors(eph, ts, case):
+    """Seconds by which each computed prayer time misses the instant skyfield's apparent Sun reaches the same altitude
+    (or transits, for dhuhr). None marks a mismatch: one side has the event that day and the other does not."""
+    times, sun, topos = case["calculator"].calculate_times_for_date(case["noon"]), eph["sun"], eph["earth"] + case["observer"]
+    day = case["tz"].localize(datetime.combine(case["noon"].date(), datetime.min.time()))
+    t0, t1 = ts.from_datetime(day - timedelta(hours=12)), ts.from_datetime(day + timedelta(hours=36))
+    transits, upper = qn.almanac.find_discrete(t0, t1, qn.almanac.meridian_transits(eph, sun, case["observer"]))
+    transit = min((t for t, y in zip(transits, upper) if y), key=lambda t: abs(t.utc_datetime() - times["dhuhr"]))
+    declination = topos.at(transit).observe(sun).apparent().radec()[1].degrees
+    asr_altitude = np.degrees(np.arctan(1 / ((2 if qn.MADHAB == "hanafi" else 1) + np.tan(np.radians(abs(case["lat"] - declination))))))
+    errors = {"dhuhr": (times["dhuhr"] - transit.utc_datetime()).total_seconds()}
+    for key, angle, rising in (("fajr", -qn.PRAYER_METHOD_ANGLES["fajr"], True), ("sunrise", -0.833, True), ("asr", asr_altitude, False),
+                               ("maghrib", -0.833, False), ("isha", -qn.PRAYER_METHOD_ANGLES["isha"], False)):
+        def above(t): return topos.at(t).observe(sun).apparent().altaz()[0].degrees > angle
+        above.step_days = 1 / 48
+        t, y = qn.almanac.find_discrete(t0, t1, above)
+        crossings = [ti.utc_datetime() for ti, yi in zip(t, y) if bool(yi) == rising]
+        if times[key] is None:
+            if any(day <= c < day + timedelta(days=1) for c in crossings): errors[key] = None
+            continue
+        nearest = min(crossings, key=lambda c: abs(c - times[key]), default=None)
+        errors[key] = (times[key] - nearest).total_seconds() if nearest and abs(nearest - times[key]) < timedelta(hours=3) else None
+    return errors
+
+def _output_drift(old, new):
+    """Largest difference in seconds between two JSON outputs of the same function; inf when anything but a time differs."""
+    if isinstance(old, dict) and isinstance(new, dict) and old.keys() == new.keys(): return max((_output_drift(old[k], new[k]) for k in old), default=0.0)
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new): return max((_output_drift(a, b) for a, b in zip(old, new)), default=0.0)
+    if old == new: return 0.0
+    try: return abs((datetime.fromisoformat(old) - datetime.fromisoformat(new)).total_seconds())
+    except (TypeError, ValueError): return float("inf")
+
+def bench_regression(baseline_path, update=False, tolerance=1.5, repeats=3):
+    """Times every calculation over fixed equatorial, mid-latitude and polar cases, checks the prayer times against
+    skyfield's Sun and compares latency, allocations, accuracy and outputs with the baseline file."""
+    eph, ts = open_ephemeris(), qn.skyfield_api.load.timescale()
+    if eph is None: print(f"regression: FAIL, ephemeris {qn.EPHEMERIS_FILE} not found"); return False  # a suite that checks nothing must not pass
+    cases = list(regression_cases(eph, ts))
+    functions = {
+        "calculate_times_for_date": lambda c: c["calculator"].calculate_times_for_date(c["noon"]),
+        "calculate_moon_mysteries": lambda c: qn.calculate_moon_mysteries(eph, c["observer"], ts, c["t"], c["tz"]),
+        "calculate_inland_tides": lambda c: qn.calculate_inland_tides(eph, c["observer"], ts, c["noon"].date(), c["tz"]),
+        "analyze_sub_point_locations": lambda c: qn.analyze_sub_point_locations(*c["moon_subpoint"], eph, ts, "moon", t=c["t"]),
+        "find_global_tide_locations": lambda c: {k: sorted(v) for k, v in qn.find_global_tide_locations(eph, ts, t=c["t"]).items()},
+    }
+    current = {"functions": {}, "prayer_accuracy": {}, "outputs": {c["label"]: {} for c in cases}}
+    for name, call in functions.items():
+        per_case, peak = [], 0
+        for case in cases:
+            runs = []
+            for _ in range(repeats):
+                t = time.perf_counter(); result = call(case); runs.append(time.perf_counter() - t)
+            per_case.append(sorted(runs)[repeats // 2])
+            tracemalloc.start(); call(case); peak = max(peak, tracemalloc.get_traced_memory()[1]); tracemalloc.stop()
+            current["outputs"][case["label"]][name] = qn.to_json_value(result)
+        current["functions"][name] = {"ms": round(sum(per_case) / len(per_case) * 1e3, 3), "peak_kb": round(peak / 1024, 1)}
+    errors = [reference_prayer_errors(eph, ts, case) for case in cases]
+    for key in qn.PRAYER_KEYS:
+        found = [e[key] for e in errors if key in e]
+        current["prayer_accuracy"][key] = {"max_error_s": round(max((abs(e) for e in found if e is not None), default=0.0), 1), "mismatches": found.count(None)}
+
+    baseline = None
+    if not update and os.path.exists(baseline_path):
+        with open(baseline_path) as f: baseline = json.load(f)
+    failures = []
+    print(f"regression: {len(cases)} cases ({len(REGRESSION_SITES)} sites x {len(REGRESSION_DATES)} dates), baseline {baseline_path if baseline else 'none'}")
+    for name, now in current["functions"].items():
+        was = (baseline or {}).get("functions", {}).get(name)
+        slow = was and now["ms"] > was["ms"] * tolerance; heavy = was and now["peak_kb"] > was["peak_kb"] * 1.25 + 64
+        failures += [f"{name} latency"] * bool(slow) + [f"{name} allocations"] * bool(heavy)
+        print(f"  {name:<28}: {now['ms']:8.3f} ms/call, peak {now['peak_kb']:8.1f} kB" + (f"  (baseline {was['ms']:.3f} ms, {was['peak_kb']:.1f} kB){'  SLOWER' * bool(slow)}{'  HEAVIER' * bool(heavy)}" if was else ""))
+    print("  prayer times vs skyfield's apparent Sun:")
+    for key, now in current["prayer_accuracy"].items():
+        was = (baseline or {}).get("prayer_accuracy", {}).get(key)
+        worse = was and (now["max_error_s"] > was["max_error_s"] + 1.0 or now["mismatches"] > was["mismatches"])
+        failures += [f"{key} accuracy"] * bool(worse)
+        print(f"    {key:<8}: max error {now['max_error_s']:7.1f} s, {now['mismatches']} existence mismatches" + (f"  (baseline {was['max_error_s']:.1f} s, {was['mismatches']}){'  WORSE' * bool(worse)}" if was else ""))
+    for label, outputs in (baseline or {}).get("outputs", {}).items():
+        for name, old in outputs.items():
+            drift = _output_drift(old, current["outputs"].get(label, {}).get(name))
+            if drift > 1.0: failures.append(f"{name} output for {label}"); print(f"  {name} output for {label} drifted by {drift:.1f} s")
+
+    if update or baseline is None:
+        with open(baseline_path, "w") as f: json.dump(current, f, indent=1, ensure_ascii=False)
+        print(f"  wrote baseline {baseline_path}")
+    if failures: print(f"  FAILED: {', '.join(failures)}")
+    return not failures
+
+class _StubLocationServer(http.server.ThreadingHTTPServer):
+    """Local stand-in for IP_LOOKUP_URL (/ip) and GEOCODER_URL (/search); `behaviour` maps each path to (delay s, HTTP status)
+    and `requests` logs (arrival time, path) for every request."""
+    daemon_threads = True
+    def __init__(self):
+        self.behaviour, self.requests = {}, []
+        server = self
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                server.requests.append((time.monotonic(), path))
+                delay, status = server.behaviour.get(path, (0.0, 404))
+                time.sleep(delay)
+                body = json.dumps({"loc": "30.0444,31.2357", "city": "Cairo"} if path == "/ip" else [{"lat": "46.73", "lon": "-117.0", "display_name": "Moscow, Idaho"}]).encode()
+                try:
+                    self.send_response(status); self.send_header("Content-Type", "application/json"); self.end_headers(); self.wfile.write(body)
+                except OSError: pass  # the client gave up
+            def log_message(self, *args): pass
+        super().__init__(("127.0.0.1", 0), Handler)
+
+def bench_resolver(deadline=1.0):
+    """Races the IP and geocoder providers against a local stub server and checks the winner, the deadline and the grace period."""
+    server = _StubLocationServer(); threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    saved = (qn.IP_LOOKUP_URL, qn.GEOCODER_URL, qn.GEOCODER_MIN_INTERVAL, qn.LOCATION_MODE, qn.CITY, qn.LOCATION_CACHE)
+    qn.IP_LOOKUP_URL, qn.GEOCODER_URL, qn.GEOCODER_MIN_INTERVAL, qn.LOCATION_MODE, qn.CITY = f"{base}/ip", base, 0.0, "AUTO", "Nowhere-in-particular"
+    qn.LOCATION_CACHE = qn.LocationCache("", 0, 0)
+    qn.timezone_at(0.0, 0.0)  # load the timezone polygons before timing anything
+    grace = qn.LOCATION_GRACE_SECONDS
+    scenarios = (("ip fast, geocoder slow", {"/ip": (0.05, 200), "/search": (0.3, 200)}, "ip", deadline),
+                 ("ip slow, geocoder fast", {"/ip": (0.3, 200), "/search": (0.05, 200)}, "ip", deadline),
+                 ("ip fails, geocoder ok", {"/ip": (0.0, 500), "/search": (0.1, 200)}, "address", deadline),
+                 ("ip hangs, geocoder ok", {"/ip": (10.0, 200), "/search": (0.1, 200)}, "address", 0.1 + grace),
+                 ("both hang", {"/ip": (10.0, 200), "/search": (10.0, 200)}, None, deadline))
+    ok = True
+    print(f"resolver: stub server at {base}, deadline {deadline:.1f} s")
+    try:
+        for name, behaviour, expected, limit in scenarios:
+            server.behaviour = behaviour
+            t = time.perf_counter(); location, stats = qn.asyncio.run(qn.resolve_location_async(qn.location_providers(), deadline)); elapsed = time.perf_counter() - t
+            passed = stats["winner"] == expected and elapsed < limit + 0.25
+            ok &= passed
+            print(f"  {name:<24}: {elapsed * 1e3:6.0f} ms, {'ok  ' if passed else 'FAIL'} {qn.format_resolution(stats)}")
+        # With a real cache file both providers' answers must be stored, whichever thread opened the database first.
+        with tempfile.TemporaryDirectory() as tmp:
+            qn.LOCATION_CACHE = qn.LocationCache(os.path.join(tmp, "cache.sqlite3"), 3600, 100)
+            server.behaviour = {"/ip": (0.05, 200), "/search": (0.05, 200)}
+            qn.asyncio.run(qn.resolve_location_async(qn.location_providers(), deadline))
+            time.sleep(0.3)  # let the losing provider finish and store its answer
+            reader = qn.LocationCache(qn.LOCATION_CACHE.path, 3600, 100)
+            keys = ("tz:30.0444,31.2357", "tz:46.7300,-117.0000", f"address:{qn.normalize_address(qn.CITY, qn.STATE, qn.COUNTRY)}")
+            missing = [key for key in keys if reader.get(key) is None]
+            ok &= not missing
+            print(f"  {'cached across threads':<24}: {'ok  ' if not missing else 'FAIL'} {len(keys) - len(missing)}/{len(keys)} lookups stored" + (f", missing {', '.join(missing)}" if missing else ""))
+    finally:
+        qn.IP_LOOKUP_URL, qn.GEOCODER_URL, qn.GEOCODER_MIN_INTERVAL, qn.LOCATION_MODE, qn.CITY, qn.LOCATION_CACHE = saved
+        server.shutdown()
+    return ok
+
+BENCHES = {"prayer": lambda args: bench_prayer_batch(args.days), "cities": lambda args: bench_city_index(args.cities),
+           "location": lambda args: bench_location_cache(), "startup": lambda args: bench_startup(),
+           "timetable": lambda args: bench_timetable(args.days),
+           "fleet": lambda args: bench_fleet(), "ephemeris": lambda args: bench_ephemeris(),
+           "resolver": lambda args: bench_resolver(), "grid": lambda args: bench_grid(),
+           "crossings": lambda args: bench_crossings(),
+           "regression": lambda args: bench_regression(args.baseline, args.update_baseline, args.tolerance)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Qibla-Numa calculations.")
+    parser.add_argument("benches", nargs="*", choices=[[]] + list(BENCHES), help="benchmarks to run (default: all)")
+    parser.add_argument("--days", type=int, default=365, help="days per location for the prayer-time and timetable benchmarks")
+    parser.add_argument("--cities", type=int, default=200000, help="gazetteer size for the city-index benchmark")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file for the regression suite (default: bench_baseline.json)")
+    parser.add_argument("--update-baseline", action="store_true", help="rewrite the regression baseline from this run instead of checking against it")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="slowdown factor the regression suite allows before failing (default: 1.5)")
+    args = parser.parse_args()
+    results = [BENCHES[name](args) for name in args.benches or BENCHES]
+    sys.exit(0 if all(results) else 1)
@@ -1,6 +1,7 @@
 #!/usr/bin/env bash
 # Wrapper to run the Qibla-Numa report in a terminal window or as a login task.
+# Prints the daemon's cached report when `try.py --daemon` is running, else runs try.py directly.
 # Usage: ./run_try.sh
 SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
 PYTHON=python3
-"$PYTHON" "$SCRIPT_DIR/try.py"
+"$PYTHON" "$SCRIPT_DIR/try_client.py" "$@"
@@ -1,16 +1,49 @@
 #!/usr/bin/env python3
 
 import os
+import sys
+import csv
+import json
+import time
+import sqlite3
+import functools
+import contextlib
+import argparse
+import importlib.util
+import signal
+import socket
+import threading
 import pytz
 import math
-import requests
+import heapq
+import bisect
+import collections
 from datetime import datetime, timedelta
-from geopy.geocoders import Nominatim
-from timezonefinder import TimezoneFinder
-from skyfield.api import load, wgs84
-from skyfield import almanac
-from skyfield.framelib import itrs
-from geopy.exc import GeocoderUnavailable, GeocoderTimedOut, GeocoderServiceError
+from try_client import DAEMON_SOCKET, fetch_report
+
+def lazy_import(name):
+    """Returns module `name` but defers executing it until an attribute is first used."""
+    if name in sys.modules: return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None: raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+# numpy, requests and skyfield each take 50-150 ms to import; the prayer times need none of them.
+np = lazy_import("numpy")
+requests = lazy_import("requests")
+skyfield_api = lazy_import("skyfield.api")
+almanac = lazy_import("skyfield.almanac")
+framelib = lazy_import("skyfield.framelib")
+asyncio = lazy_import("asyncio")
+
+def finish_lazy_imports(*modules):
+    """Completes loading lazy_import()ed modules on this thread. LazyLoader is not thread-safe: two threads touching a
+    module first at once can each see it half-initialized, so worker threads must only use modules finished here."""
+    for module in modules: getattr(module, "__name__")
 
 # ==============================================================================
 # --- SANKALPA INSCRIPTION (THE SACRED DECREE) ---
@@ -33,8 +66,28 @@ MADHAB = "hanafi"
 # 2.  Set Location Manually: Set LOCATION_MODE to "ADDRESS" or "COORDS" and
 #     provide the city/country or latitude/longitude above. This will prevent
 #     any internet lookups for your location.
+# 3.  Lookups are cached: geocoding and timezone results are kept in the SQLite
+#     file below so repeated launches skip the network and the polygon data.
+#     Set LOCATION_CACHE_FILE to "" to disable the cache.
+# 4.  Trim the ephemeris: `python3 try.py --extract-ephemeris sun-moon-earth.bsp
+#     --years 2020 2060` writes a kernel holding only the bodies below for those
+#     years; point EPHEMERIS_FILE at it. Kernels are memory-mapped read-only, so
+#     the daemon and fleet workers all share one copy through the page cache.
 # ==============================================================================
 
+LOCATION_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".qibla_numa_cache.sqlite3")
+LOCATION_CACHE_TTL_DAYS = 30
+LOCATION_CACHE_MAX_ENTRIES = 5000
+REPORT_STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".qibla_numa_state.json")  # last run's events, reused until they expire; "" disables
+LOCATION_DEADLINE_SECONDS = 6.0  # startup never waits longer than this for the IP lookup or geocoder
+LOCATION_GRACE_SECONDS = 0.5  # how long a preferred provider still gets once a less preferred one has answered
+CITY_STORE_FILE = ""  # a gazetteer written by --build-city-store; "" uses the bundled WORLD_CITIES below
+IP_LOOKUP_URL = "https://ipinfo.io/json"
+GEOCODER_URL = "https://nominatim.openstreetmap.org"
+GEOCODER_MIN_INTERVAL = 1.0  # seconds between geocoder requests from this process; Nominatim's usage policy allows one per second
+EPHEMERIS_FILE = "de421.bsp"
+EPHEMERIS_BODIES = ("sun", "moon", "earth", "jupiter barycenter", "saturn barycenter")  # apparent() bends light around Jupiter and Saturn too
+
 # ==============================================================================
 # --- Expanded City Database with Population ---
 # Format: (City, Country, Latitude, Longitude, Population)
@@ -153,7 +206,13 @@ WORLD_CITIES = [
     ("Yerevan", "Armenia", 40.1792, 44.4991, 1075800), ("Zagreb", "Croatia", 45.815, 15.9819, 806341)
 ]
 
-CITIES = {f"{c[0]}, {c[1]}": (c[2], c[3]) for c in WORLD_CITIES}
+@functools.lru_cache(maxsize=None)
+def get_timezone(name):
+    """pytz.timezone without the ~25 ms scan of every zone file that its first call makes for case-insensitive lookup."""
+    if name.upper() == 'UTC': return pytz.utc
+    try:
+        with pytz.open_resource(name) as fp: return pytz.tzfile.build_tzinfo(name, fp)
+    except (OSError, ValueError): return pytz.timezone(name)
 
 def haversine_km(lat1, lon1, lat2, lon2):
     """Calculates the distance between two points on Earth."""
@@ -161,6 +220,189 @@ def haversine_km(lat1, lon1, lat2, lon2):
     a = math.sin(math.radians(lat2 - lat1)/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(math.radians(lon2 - lon1)/2)**2
     return 2 * R * math.asin(math.sqrt(a))
 
+def latlon_to_xyz(lat, lon):
+    """Unit vectors on the sphere for arrays of latitudes and longitudes in degrees."""
+    phi, lam = np.radians(lat), np.radians(lon)
+    return np.stack([np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)], axis=-1)
+
+City = collections.namedtuple("City", "name country latitude longitude population")
+
+class StringTable:
+    """Sorted, de-duplicated strings stored as one UTF-8 blob plus offsets; a string's id is its position in the table."""
+    def __init__(self, offsets, blob): self.offsets, self.blob = offsets, blob
+    @classmethod
+    def build(cls, strings):
+        """(table, ids) where ids[i] is the id of strings[i]."""
+        unique = sorted(set(strings))  # code-point order, which is also UTF-8 byte order
+        encoded, ids = [u.encode("utf-8") for u in unique], {u: i for i, u in enumerate(unique)}
+        offsets = np.zeros(len(unique) + 1, dtype=np.int64); np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        return cls(offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)), np.array([ids[x] for x in strings], dtype=np.int32)
+    def __len__(self): return len(self.offsets) - 1
+    def _bytes(self, i): return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+    def __getitem__(self, i): return self._bytes(i).decode("utf-8")
+    def find(self, text):
+        """The id of `text`, or -1; a binary search that decodes only O(log n) entries."""
+        key = text.encode("utf-8")
+        i = bisect.bisect_left(range(len(self)), key, key=self._bytes)
+        return i if i < len(self) and self._bytes(i) == key else -1
+
+class CityStore:
+    """Columnar gazetteer: contiguous lat/lon/population arrays with precomputed radians and unit vectors, and names and
+    countries interned in StringTables.
+
+    save() writes every column into one binary file and load() memory-maps it, so a gazetteer of millions of cities
+    opens in milliseconds and only the pages a query touches become resident. City records are built on access.
+    """
+    MAGIC, ALIGN = b"QNCITY1\n", 64
+    def __init__(self, columns):
+        self.columns = columns
+        for name, column in columns.items(): setattr(self, name, column)
+        self.names, self.countries = StringTable(self.name_offsets, self.name_blob), StringTable(self.country_offsets, self.country_blob)
+    @classmethod
+    def from_rows(cls, rows):
+        """Builds a store from (name, country, latitude, longitude, population) rows."""
+        rows = list(rows)
+        lat, lon = np.array([r[2] for r in rows], dtype=float), np.array([r[3] for r in rows], dtype=float)
+        names, name_id = StringTable.build([r[0] for r in rows]); countries, country_id = StringTable.build([r[1] for r in rows])
+        key = name_id.astype(np.int64) * max(len(countries), 1) + country_id
+        key_order = np.argsort(key, kind="stable").astype(np.int32)
+        return cls({"lat": lat, "lon": lon, "pop": np.array([r[4] for r in rows], dtype=float), "lat_rad": np.radians(lat), "lon_rad": np.radians(lon),
+                    "xyz": latlon_to_xyz(lat, lon).reshape(-1, 3), "name_id": name_id, "country_id": country_id, "key_order": key_order, "key_sorted": key[key_order],
+                    "name_offsets": names.offsets, "name_blob": names.blob, "country_offsets": countries.offsets, "country_blob": countries.blob})
+    def save(self, path):
+        header, offset = {}, 0
+        for name, column in self.columns.items():
+            header[name] = [column.dtype.str, list(column.shape), offset]; offset += -(-column.nbytes // self.ALIGN) * self.ALIGN
+        text = json.dumps(header).encode()
+        start = -(-(len(self.MAGIC) + 8 + len(text)) // self.ALIGN) * self.ALIGN
+        with open(path, "wb") as f:
+            f.write(self.MAGIC + len(text).to_bytes(8, "little") + text)
+            for name, column in self.columns.items(): f.seek(start + header[name][2]); f.write(np.ascontiguousarray(column).tobytes())
+            f.truncate(start + offset)
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC: raise ValueError(f"{path} is not a city store")
+            size = int.from_bytes(f.read(8), "little"); header = json.loads(f.read(size))
+        start, data = -(-(len(cls.MAGIC) + 8 + size) // cls.ALIGN) * cls.ALIGN, np.asarray(np.memmap(path, dtype=np.uint8, mode="r"))
+        def column(dtype, shape, offset):
+            dtype = np.dtype(dtype)
+            return data[start + offset:start + offset + dtype.itemsize * math.prod(shape)].view(dtype).reshape(shape)
+        return cls({name: column(*spec) for name, spec in header.items()})
+    def __len__(self): return len(self.lat)
+    def __getitem__(self, i):
+        return City(self.names[self.name_id[i]], self.countries[self.country_id[i]], float(self.lat[i]), float(self.lon[i]), int(self.pop[i]))
+    def find(self, name, country):
+        """The index of the city called `name` in `country` (exact match), or None."""
+        name_id, country_id = self.names.find(name), self.countries.find(country)
+        if name_id < 0 or country_id < 0: return None
+        key = name_id * max(len(self.countries), 1) + country_id
+        i = int(np.searchsorted(self.key_sorted, key, side="right")) - 1
+        return int(self.key_order[i]) if i >= 0 and self.key_sorted[i] == key else None
+
+@functools.lru_cache(maxsize=None)
+def get_city_store():
+    """CITY_STORE_FILE memory-mapped when set, otherwise a store built from WORLD_CITIES on first use."""
+    return CityStore.load(CITY_STORE_FILE) if CITY_STORE_FILE else CityStore.from_rows(WORLD_CITIES)
+
+class CityIndex:
+    """K-d tree over a CityStore's unit vectors answering nearest, radius and influence (population / distance²) queries.
+
+    Chord length is monotonic in great-circle distance, so box-to-point chord bounds prune exactly.
+    Queries take an optional boolean `mask` over the cities; ties resolve to the earliest city, like min()/max().
+    A store saved with tree_columns() (as --build-city-store does) carries the tree, which is then memory-mapped
+    instead of rebuilt; leaf_size only applies when building.
+    """
+    R = 6371.0
+    TREE = ("order", "_span", "_child", "_box_lo", "_box_hi", "_max_pop")
+    def __init__(self, store, leaf_size=16):
+        self.store, self.leaf_size = store, leaf_size
+        self.lat, self.lon, self.pop, self.xyz = store.lat, store.lon, store.pop, store.xyz
+        if all(f"kd{name}" in store.columns for name in self.TREE):
+            for name in self.TREE: setattr(self, name, store.columns[f"kd{name}"])
+            return
+        self.order = np.arange(len(store))
+        self._span, self._child, self._box_lo, self._box_hi, self._max_pop = [], [], [], [], []
+        if len(store): self._build(0, len(store))
+        self._span, self._child = np.array(self._span, dtype=np.int64).reshape(-1, 2), np.array(self._child, dtype=np.int64).reshape(-1, 2)
+        self._box_lo, self._box_hi, self._max_pop = np.array(self._box_lo).reshape(-1, 3), np.array(self._box_hi).reshape(-1, 3), np.array(self._max_pop, dtype=float)
+    def tree_columns(self):
+        """The tree as extra CityStore columns, so a saved store loads with its index prebuilt."""
+        return {f"kd{name}": getattr(self, name) for name in self.TREE}
+    def _build(self, lo, hi):
+        node, members = len(self._span), self.order[lo:hi]
+        pts = self.xyz[members]
+        self._span.append((lo, hi)); self._child.append((-1, -1))
+        self._box_lo.append(pts.min(axis=0)); self._box_hi.append(pts.max(axis=0)); self._max_pop.append(self.pop[members].max())
+        if hi - lo > self.leaf_size:
+            axis, mid = int(np.argmax(pts.max(axis=0) - pts.min(axis=0))), (lo + hi) // 2
+            self.order[lo:hi] = members[np.argpartition(pts[:, axis], mid - lo)]
+            self._child[node] = (self._build(lo, mid), self._build(mid, hi))
+        return node
+    def _children(self, node):
+        left, right = self._child[node].tolist()
+        return (left, right) if left >= 0 else None
+    def _chord_to_box(self, node, q):
+        return float(np.linalg.norm(q - np.clip(q, self._box_lo[node], self._box_hi[node])))
+    def _leaf(self, node, q, mask):
+        lo, hi = self._span[node].tolist()
+        members = self.order[lo:hi]
+        if mask is not None: members = members[mask[members]]
+        return members, np.linalg.norm(self.xyz[members] - q, axis=1)
+    def _km(self, chord): return 2 * self.R * np.arcsin(np.minimum(chord / 2, 1.0))
+    def _query(self, lat, lon): return latlon_to_xyz(lat, lon).reshape(3)
+    def nearest(self, lat, lon, k=1, mask=None):
+        """The k closest cities as (city, distance_km) pairs, nearest first."""
+        if not len(self._span): return []
+        q, best, heap = self._query(lat, lon), [], [(0.0, 0)]
+        while heap:
+            bound, node = heapq.heappop(heap)
+            if len(best) == k and bound > -best[0][0]: break
+            if children := self._children(node):
+                for child in children: heapq.heappush(heap, (self._chord_to_box(child, q), child))
+                continue
+            for i, chord in zip(*self._leaf(node, q, mask)):
+                item = (-chord, -i)
+                if len(best) < k: heapq.heappush(best, item)
+                elif item > best[0]: heapq.heapreplace(best, item)
+        return [(self.store[-i], float(self._km(-c))) for c, i in sorted(best, reverse=True)]
+    def within(self, lat, lon, radius_km, mask=None):
+        """All cities within radius_km as (city, distance_km) pairs, nearest first."""
+        if not len(self._span): return []
+        q, limit, found, stack = self._query(lat, lon), 2 * math.sin(min(radius_km / self.R, math.pi) / 2), [], [0]
+        while stack:
+            node = stack.pop()
+            if self._chord_to_box(node, q) > limit: continue
+            if children := self._children(node): stack.extend(children); continue
+            members, chords = self._leaf(node, q, mask)
+            found.extend((chord, i) for i, chord in zip(members, chords) if chord <= limit)
+        return [(self.store[i], float(self._km(chord))) for chord, i in sorted(found)]
+    def most_influential(self, lat, lon, mask=None, exclude=None):
+        """The city maximising population / distance_km² (infinite within 1 km), or None; `exclude` skips every city with that name."""
+        if not len(self._span): return None
+        if exclude is not None: mask = (np.ones(len(self.store), dtype=bool) if mask is None else mask) & (self.store.name_id != self.store.names.find(exclude))
+        q, best, heap = self._query(lat, lon), (-1.0, 0), [(-math.inf, 0)]
+        while heap:
+            neg_bound, node = heapq.heappop(heap)
+            if -neg_bound < best[0]: break
+            if children := self._children(node):
+                for child in children:
+                    dist = float(self._km(self._chord_to_box(child, q)))
+                    heapq.heappush(heap, (-(self._max_pop[child] / dist**2 if dist > 1 else math.inf), child))
+                continue
+            members, chords = self._leaf(node, q, mask)
+            if not len(members): continue
+            dist = self._km(chords)
+            with np.errstate(divide='ignore'): scores = np.where(dist > 1, self.pop[members] / dist**2, math.inf)
+            for i, score in zip(members, scores):
+                if (score, -i) > best: best = (float(score), -i)
+        return self.store[-best[1]] if best[0] >= 0 else None
+
+@functools.lru_cache(maxsize=None)
+def get_city_index():
+    """The CityIndex over get_city_store(), built on first use."""
+    return CityIndex(get_city_store())
+
 class LocalPrayerCalculator:
     """Calculates prayer times from first principles."""
     def __init__(self, latitude, longitude, timezone_str, madhab, fajr_angle, isha_angle):
@@ -175,8 +417,7 @@ class LocalPrayerCalculator:
         obliquity = 23.439 - 0.00000036 * julian_date
         right_ascension = math.degrees(math.atan2(math.cos(math.radians(obliquity)) * math.sin(math.radians(ecliptic_longitude)), math.cos(math.radians(ecliptic_longitude))))
         declination = math.degrees(math.asin(math.sin(math.radians(obliquity)) * math.sin(math.radians(ecliptic_longitude))))
-        equation_of_time = (mean_longitude / 15.0) - (right_ascension / 15.0)
-        if (mean_longitude / 15.0) > 20 and (right_ascension / 15.0) < 4: equation_of_time += 24
+        equation_of_time = ((mean_longitude - right_ascension + 180) % 360 - 180) / 15.0  # wrapped to +/-12 h; atan2 puts RA in -180..180
         return declination, equation_of_time
     def _calculate_time_from_angle(self, angle, declination, eot, is_sunrise=False):
         lat_rad, dec_rad, angle_rad = math.radians(self.lat), math.radians(declination), math.radians(angle)
@@ -186,10 +427,10 @@ class LocalPrayerCalculator:
         transit = 12 - (self.lon / 15.0) - eot
         return transit + (hour_angle / 15.0)
     def calculate_times_for_date(self, dt_local):
-        dt_utc = dt_local.astimezone(pytz.utc)
+        dt_utc, tz = dt_local.astimezone(pytz.utc), get_timezone(self.tz_str)
         def to_local(utc_hour):
             if utc_hour is None: return None
-            return (dt_utc.replace(hour=0, minute=0, second=0) + timedelta(hours=utc_hour)).astimezone(pytz.timezone(self.tz_str))
+            return (dt_utc.replace(hour=0, minute=0, second=0) + timedelta(hours=utc_hour)).astimezone(tz)
         declination, eot = self._calculate_sun_position(self._get_julian_date(dt_utc))
         shadow_length = 2 if self.madhab == 'hanafi' else 1
         asr_angle = math.degrees(math.atan(1 / (shadow_length + math.tan(abs(math.radians(self.lat - declination))))))
@@ -202,44 +443,289 @@ class LocalPrayerCalculator:
             "isha": to_local(self._calculate_time_from_angle(-self.isha_angle, declination, eot)),
         }
 
+PRAYER_KEYS = ("fajr", "sunrise", "dhuhr", "asr", "maghrib", "isha")
+J2000_EPOCH = 946728000.0  # 2000-01-01 12:00 UTC in Unix seconds
+
+def to_epoch_seconds(instants):
+    """Converts datetime64 values, aware datetimes or Unix seconds to a float array of Unix seconds."""
+    arr = np.asarray(instants)
+    if arr.dtype.kind == 'M': return arr.astype('datetime64[us]').astype(np.int64) / 1e6
+    if arr.dtype.kind == 'O': return np.vectorize(lambda d: d.timestamp(), otypes=[float])(arr)
+    return arr.astype(float)
+
+class BatchPrayerCalculator:
+    """Vectorized LocalPrayerCalculator: the same formulas evaluated over broadcast arrays of locations and instants."""
+    def __init__(self, latitudes, longitudes, madhab, fajr_angle, isha_angle):
+        self.lat, self.lon = np.asarray(latitudes, dtype=float), np.asarray(longitudes, dtype=float)
+        self.madhab, self.fajr_angle, self.isha_angle = madhab, fajr_angle, isha_angle
+    def _calculate_sun_position(self, julian_date):
+        mean_solar_anomaly = np.radians((357.5291 + 0.98560028 * julian_date) % 360)
+        mean_longitude = (280.459 + 0.98564736 * julian_date) % 360
+        ecliptic_longitude = np.radians((mean_longitude + 1.915 * np.sin(mean_solar_anomaly) + 0.020 * np.sin(2 * mean_solar_anomaly)) % 360)
+        obliquity = np.radians(23.439 - 0.00000036 * julian_date)
+        right_ascension = np.degrees(np.arctan2(np.cos(obliquity) * np.sin(ecliptic_longitude), np.cos(ecliptic_longitude)))
+        declination = np.degrees(np.arcsin(np.sin(obliquity) * np.sin(ecliptic_longitude)))
+        equation_of_time = ((mean_longitude - right_ascension + 180) % 360 - 180) / 15.0
+        return declination, equation_of_time
+    def _calculate_time_from_angle(self, angle, declination, eot, is_sunrise=False):
+        """Returns (utc_hours, valid); rows where the scalar acos would raise ValueError are NaN and invalid."""
+        lat_rad, dec_rad = np.radians(self.lat), np.radians(declination)
+        cos_h = (np.sin(np.radians(angle)) - np.sin(lat_rad) * np.sin(dec_rad)) / (np.cos(lat_rad) * np.cos(dec_rad))
+        valid = np.abs(cos_h) <= 1.0
+        with np.errstate(invalid='ignore'): hour_angle = np.degrees(np.arccos(np.where(valid, cos_h, np.nan)))
+        if is_sunrise: hour_angle = -hour_angle
+        transit = 12 - (self.lon / 15.0) - eot
+        return transit + (hour_angle / 15.0), valid
+    def calculate_times(self, instants):
+        """Returns a columnar dict: per prayer, Unix seconds (NaN when absent) and a '<name>_valid' boolean mask."""
+        lat, lon, epoch = np.broadcast_arrays(self.lat, self.lon, to_epoch_seconds(instants))
+        day_start = epoch - np.mod(epoch, 86400.0)
+        declination, eot = self._calculate_sun_position((epoch - J2000_EPOCH) / 86400.0)
+        columns = {"latitude": lat, "longitude": lon, "instant": epoch}
+        for key in PRAYER_KEYS:
+            utc_hour, valid = self._utc_hours(key, declination, eot)
+            columns[key], columns[f"{key}_valid"] = day_start + utc_hour * 3600.0, np.broadcast_to(valid, epoch.shape)
+        return columns
+    def _utc_hours(self, key, declination, eot):
+        """(utc_hours, valid) of one prayer on the UTC day whose Sun position is (declination, eot)."""
+        if key == "dhuhr": return 12 - (self.lon / 15.0) - eot, np.array(True)
+        if key == "asr":
+            shadow_length = 2 if self.madhab == 'hanafi' else 1
+            return self._calculate_time_from_angle(np.degrees(np.arctan(1 / (shadow_length + np.tan(np.abs(np.radians(self.lat - declination)))))), declination, eot)
+        angle, is_sunrise = {"fajr": (-self.fajr_angle, True), "sunrise": (-0.833, True), "maghrib": (-0.833, False), "isha": (-self.isha_angle, False)}[key]
+        return self._calculate_time_from_angle(angle, declination, eot, is_sunrise=is_sunrise)
+    def next_times(self, instant, keys=PRAYER_KEYS, days=3):
+        """Unix seconds of each prayer's first occurrence after `instant` (a scalar) over the next `days` UTC days, NaN where none.
+
+        Each UTC day's times are worked out from the Sun at `instant` plus whole days, as calculate_times() would; the
+        day before is included too, since a far-eastern Fajr or far-western Maghrib can fall outside its own UTC day.
+        """
+        epoch = float(to_epoch_seconds(instant))
+        best = {key: np.full(np.broadcast_shapes(self.lat.shape, self.lon.shape), np.inf) for key in keys}
+        for k in range(-1, days):
+            day_epoch = epoch + k * 86400.0
+            declination, eot = self._calculate_sun_position((day_epoch - J2000_EPOCH) / 86400.0)
+            for key in keys:
+                utc_hour, valid = self._utc_hours(key, declination, eot)
+                when = (day_epoch - day_epoch % 86400.0) + utc_hour * 3600.0
+                np.minimum(best[key], np.where(valid & (when > epoch), when, np.inf), out=best[key])
+        return {key: np.where(np.isinf(v), np.nan, v) for key, v in best.items()}
+
+class LocationCache:
+    """SQLite-backed JSON cache for geocoding and timezone lookups, with TTL expiry and least-recently-used eviction.
+
+    The cache is best effort: any SQLite error is treated as a miss, and failed lookups (None) are never stored.
+    Each thread gets its own connection, since the location providers run in threads of their own.
+    """
+    def __init__(self, path, ttl_seconds, max_entries):
+        self.path, self.ttl, self.max_entries, self._local = path, ttl_seconds, max_entries, threading.local()
+    def reset(self):
+        """Forgets every connection, e.g. in a forked child that must not share its parent's."""
+        self._local = threading.local()
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=1.0)
+            db.execute("PRAGMA synchronous = OFF")
+            db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+        return db
+    def get(self, key):
+        if not self.path: return None
+        try:
+            db, now = self._connect(), time.time()
+            row = db.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None: return None
+            with db:
+                if now - row[1] > self.ttl:
+                    db.execute("DELETE FROM cache WHERE key = ?", (key,)); return None
+                db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+        except (sqlite3.Error, ValueError): return None
+    def put(self, key, value):
+        if not self.path or value is None: return
+        try:
+            db, now = self._connect(), time.time()
+            with db:
+                db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)", (key, json.dumps(value), now, now))
+                db.execute("DELETE FROM cache WHERE created < ?", (now - self.ttl,))
+                db.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+        except sqlite3.Error: pass
+    def cached(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute(); self.put(key, value)
+        return value
+
+LOCATION_CACHE = LocationCache(LOCATION_CACHE_FILE, LOCATION_CACHE_TTL_DAYS * 86400, LOCATION_CACHE_MAX_ENTRIES)
+
+@functools.lru_cache(maxsize=None)
+def get_timezone_finder():
+    """One TimezoneFinder per process; building it loads the timezone polygon data."""
+    from timezonefinder import TimezoneFinder
+    return TimezoneFinder()
+
+def timezone_at(lat, lon):
+    return LOCATION_CACHE.cached(f"tz:{lat:.4f},{lon:.4f}", lambda: get_timezone_finder().timezone_at(lng=lon, lat=lat))
+
+def normalize_address(*parts): return ", ".join(" ".join(str(p).lower().split()) for p in parts)
+
+def fetch_ip_location(timeout=5):
+    """The location of this machine's public IP from IP_LOOKUP_URL; raises on network or response errors."""
+    response = requests.get(IP_LOOKUP_URL, timeout=timeout)
+    response.raise_for_status()
+    data = response.json()
+    lat, lon = map(float, data['loc'].split(','))
+    return {"latitude": lat, "longitude": lon, "timezone": timezone_at(lat, lon), "address": f"Current Location ({data.get('city', 'Unknown')})"}
+
+def find_city(name, country):
+    """(latitude, longitude) of the bundled or CITY_STORE_FILE city called `name` in `country`, or None.
+
+    The bundled list is scanned directly, so a name lookup never imports numpy or builds the store.
+    """
+    if not CITY_STORE_FILE: return next(((lat, lon) for n, c, lat, lon, _ in WORLD_CITIES if n == name and c == country), None)
+    store = get_city_store()
+    i = store.find(name, country)
+    return None if i is None else (float(store.lat[i]), float(store.lon[i]))
+
+_GEOCODER_LOCK, _GEOCODER_LAST = threading.Lock(), [0.0]
+
+def wait_for_geocoder():
+    """Blocks until GEOCODER_MIN_INTERVAL has passed since this process's previous geocoder request, from any thread."""
+    with _GEOCODER_LOCK:
+        time.sleep(max(0.0, _GEOCODER_LAST[0] + GEOCODER_MIN_INTERVAL - time.monotonic()))
+        _GEOCODER_LAST[0] = time.monotonic()
+
+def lookup_address(city, state, country, timeout=5, offline=False):
+    """A bundled city, or else a (cached) geocode from GEOCODER_URL; None when nothing matches, raises on network errors.
+
+    With offline=True nothing is fetched: an address that is neither bundled nor cached gives None.
+    """
+    if (found := find_city(city, country)) is not None:
+        lat, lon = found
+        return {"latitude": lat, "longitude": lon, "timezone": timezone_at(lat, lon), "address": f"{city}, {country}"}
+    key = f"address:{normalize_address(city, state, country)}"
+    if offline: return LOCATION_CACHE.get(key)
+    def geocode():
+        from geopy.geocoders import Nominatim
+        scheme, _, domain = GEOCODER_URL.partition("://")
+        wait_for_geocoder()
+        loc = Nominatim(user_agent="cosmic_compass", domain=domain, scheme=scheme).geocode(f"{city}, {state}, {country}", timeout=timeout)
+        if loc: return {"latitude": loc.latitude, "longitude": loc.longitude, "timezone": timezone_at(loc.latitude, loc.longitude), "address": loc.address}
+    return LOCATION_CACHE.cached(key, geocode)
+
 def get_location_by_ip():
-    try:
-        data = requests.get('https://ipinfo.io/json', timeout=5).json()
-        lat, lon = map(float, data['loc'].split(','))
-        tf = TimezoneFinder()
-        return {"latitude": lat, "longitude": lon, "timezone": tf.timezone_at(lng=lon, lat=lat), "address": f"Current Location ({data.get('city', 'Unknown')})"}
-    except (requests.exceptions.ConnectionError, Exception): return None
-
-def get_location_by_address(city, state, country):
-    city_key = f"{city}, {country}"
-    if city_key in CITIES:
-        lat, lon = CITIES[city_key]
-        tf = TimezoneFinder()
-        return {"latitude": lat, "longitude": lon, "timezone": tf.timezone_at(lng=lon, lat=lat), "address": city_key}
-    try:
-        geolocator = Nominatim(user_agent="cosmic_compass")
-        loc = geolocator.geocode(f"{city}, {state}, {country}", timeout=5)
-        if loc:
-            tf = TimezoneFinder()
-            return {"latitude": loc.latitude, "longitude": loc.longitude, "timezone": tf.timezone_at(lng=loc.longitude, lat=loc.latitude), "address": loc.address}
-    except (GeocoderServiceError, Exception): return None
+    try: return fetch_ip_location()
+    except Exception: return None
+
+def get_location_by_address(city, state, country, offline=False):
+    try: return lookup_address(city, state, country, offline=offline)
+    except Exception: return None
 
 def get_location_by_coords(lat, lon):
     if not all((lat, lon, str(lat).strip(), str(lon).strip())): return None
     try:
         lat_f, lon_f = float(lat), float(lon)
-        tf = TimezoneFinder()
-        tz_str = tf.timezone_at(lng=lon_f, lat=lat_f)
+        tz_str = timezone_at(lat_f, lon_f)
         if tz_str: return {"latitude": lat_f, "longitude": lon_f, "timezone": tz_str, "address": f"Coordinates ({lat_f}, {lon_f})"}
     except Exception: return None
 
-def calculate_moon_mysteries(eph, observer, ts, t0, tz):
+def moon_search_window(t0, tz):
+    day_start = t0.astimezone(tz).replace(hour=0, minute=0, second=0, microsecond=0)
+    return day_start - timedelta(days=2), day_start + timedelta(days=2)
+
+def tide_search_window(target_date, tz):
+    day_start = datetime(target_date.year, target_date.month, target_date.day, tzinfo=tz)
+    return day_start - timedelta(hours=12), day_start + timedelta(hours=36)
+
+def find_altitude_crossings(eph, body_name, observer, ts, start, end, altitude, step_days=1 / 12, epsilon_days=0.001 / 86400):
+    """When body_name's apparent altitude for observer crosses `altitude` between the Times start and end.
+
+    `altitude` is degrees, or a function of a Time array giving degrees, for thresholds that drift such as the
+    Asr shadow angle. Returns (Time array, bool array) like find_discrete on `altitude above threshold`: True where
+    the body rises through it. Altitudes are sampled every step_days in one vectorized call, plus the parabolic
+    vertex of each sampled extremum so a brief excursion across the threshold is not stepped over. The brackets are
+    then refined together, one vectorized call per step, by Anderson-Bjorck regula falsi until the secant step or
+    the bracket is within epsilon_days (find_discrete's default precision).
+    """
+    topos, body = eph['earth'] + observer, eph[body_name]
+    def excess(jd):
+        t = ts.tt_jd(jd)
+        return topos.at(t).observe(body).apparent().altaz()[0].degrees - (altitude(t) if callable(altitude) else altitude)
+    jd = np.linspace(start.tt, end.tt, max(3, int(math.ceil((end.tt - start.tt) / step_days)) + 1))
+    y = excess(jd)
+    turns = np.nonzero((y[1:-1] - y[:-2]) * (y[2:] - y[1:-1]) < 0)[0] + 1
+    if turns.size:
+        curvature = y[turns + 1] - 2 * y[turns] + y[turns - 1]
+        vertex = jd[turns] - (jd[1] - jd[0]) * (y[turns + 1] - y[turns - 1]) / (2 * curvature)
+        order = np.argsort(np.concatenate([jd, vertex]), kind="stable")
+        jd, y = np.concatenate([jd, vertex])[order], np.concatenate([y, excess(vertex)])[order]
+    k = np.nonzero((y[:-1] > 0) != (y[1:] > 0))[0]
+    rising = y[k + 1] > 0
+    a, fa, b, fb = jd[k], y[k], jd[k + 1], y[k + 1]
+    for _ in range(60):
+        i = np.nonzero(np.abs(b - a) > epsilon_days)[0]
+        if not i.size: break
+        slope = (fb[i] - fa[i]) / (b[i] - a[i])
+        c = b[i] - fb[i] / slope
+        fc = excess(c)
+        swap, done = (fc > 0) != (fb[i] > 0), np.abs(fc) <= np.abs(slope) * epsilon_days
+        scale = np.where(1 - fc / fb[i] > 0, 1 - fc / fb[i], 0.5)  # Anderson-Bjorck: shrink the stale end's value
+        a[i], fa[i] = np.where(done, c, np.where(swap, b[i], a[i])), np.where(swap, fb[i], fa[i] * scale)
+        b[i], fb[i] = c, fc
+    return ts.tt_jd(b), rising
+
+class LunarTimeline:
+    """Moon events for one observer, each family searched once over [start, end] and shared by every consumer.
+
+    Rise/set, meridian transits (with their altitudes, sampled in one vectorized call) and 45° crossings are
+    searched lazily on first use; phases are memoised per window since they span weeks rather than days.
+    """
+    def __init__(self, eph, observer, ts, start, end):
+        self.eph, self.observer, self.ts, self.start, self.end = eph, observer, ts, start, end
+        self.moon, self.topos = eph['moon'], eph['earth'] + observer
+        self._start_ts, self._end_ts, self._phases = ts.from_datetime(start), ts.from_datetime(end), {}
+    def covers(self, start, end): return self.start <= start and end <= self.end
+    def altitudes(self, t): return self.topos.at(t).observe(self.moon).apparent().altaz()[0].degrees
+    def _in_window(self, t, start, end): return (t.tt >= self.ts.from_datetime(start or self.start).tt) & (t.tt <= self.ts.from_datetime(end or self.end).tt)
+    def _between(self, t, y, start, end):
+        if start is None and end is None: return t, y
+        mask = self._in_window(t, start, end)
+        return t[mask], y[mask]
+    @functools.cached_property
+    def _risings_and_settings(self): return almanac.find_discrete(self._start_ts, self._end_ts, almanac.risings_and_settings(self.eph, self.moon, self.observer))
+    @functools.cached_property
+    def _transits(self):
+        t, y = almanac.find_discrete(self._start_ts, self._end_ts, almanac.meridian_transits(self.eph, self.moon, self.observer))
+        return t, y, (self.altitudes(t) if len(t) else np.array([]))
+    @functools.cached_property
+    def _crossings_45(self): return find_altitude_crossings(self.eph, 'moon', self.observer, self.ts, self._start_ts, self._end_ts, 45.0)
+    def risings_and_settings(self, start=None, end=None): return self._between(*self._risings_and_settings, start, end)
+    def transits(self, start=None, end=None): return self._between(*self._transits[:2], start, end)
+    def crossings_45(self, start=None, end=None): return self._between(*self._crossings_45, start, end)
+    def highest_transit(self, start=None, end=None):
+        t, _, alt = self._transits
+        if start is not None or end is not None:
+            mask = self._in_window(t, start, end)
+            t, alt = t[mask], alt[mask]
+        return t[int(np.argmax(alt))] if len(t) else None
+    def phases(self, start, end):
+        key = (start, end)
+        if key not in self._phases: self._phases[key] = almanac.find_discrete(self.ts.from_datetime(start), self.ts.from_datetime(end), almanac.moon_phases(self.eph))
+        return self._phases[key]
+
+def calculate_moon_mysteries(eph, observer, ts, t0, tz, timeline=None, own_day=False):
+    """The Moon's rise, transit, set and 45° crossings for the local day of the skyfield Time t0.
+
+    The report takes the highest transit of the search window and falls back to the nearest event on another day;
+    with own_day=True (a timetable row) every event is that date's or None, the transit being its upper transit.
+    """
     now_dt, day_start = t0.astimezone(tz), t0.astimezone(tz).replace(hour=0, minute=0, second=0, microsecond=0)
-    search_start_ts, search_end_ts = ts.from_datetime(day_start - timedelta(days=2)), ts.from_datetime(day_start + timedelta(days=2))
+    search_start, search_end = moon_search_window(t0, tz)
     def _to_dt(t): return t.utc_datetime().replace(tzinfo=pytz.utc).astimezone(tz)
     
     moon_times = {"rise": None, "transit": None, "set": None, "ascent_45": None, "descent_45": None}
     try:
+        if timeline is None or not timeline.covers(search_start, search_end): timeline = LunarTimeline(eph, observer, ts, search_start, search_end)
         def choose_best(events, start_day_dt):
             if not events: return None
             end_day_dt = start_day_dt + timedelta(days=1)
@@ -247,30 +733,30 @@ def calculate_moon_mysteries(eph, observer, ts, t0, tz):
                 if start_day_dt <= e < end_day_dt: return e
             return min(events, key=lambda x: abs(x - (start_day_dt + timedelta(hours=12))))
         
-        t_rise, y_rise = almanac.find_discrete(search_start_ts, search_end_ts, almanac.risings_and_settings(eph, eph['moon'], observer))
+        t_rise, y_rise = timeline.risings_and_settings(search_start, search_end)
         moon_times['rise'], moon_times['set'] = choose_best([_to_dt(t) for t, y in zip(t_rise, y_rise) if y], day_start), choose_best([_to_dt(t) for t, y in zip(t_rise, y_rise) if not y], day_start)
 
-        t_transit, _ = almanac.find_discrete(search_start_ts, search_end_ts, almanac.meridian_transits(eph, eph['moon'], observer))
-        if t_transit:
-            highest_transit = max(t_transit, key=lambda t: (eph['earth'] + observer).at(t).observe(eph['moon']).apparent().altaz()[0].degrees)
-            moon_times['transit'] = _to_dt(highest_transit)
+        if own_day:
+            transits, upper = timeline.transits(day_start, tz.localize(datetime.combine(day_start.date() + timedelta(days=1), datetime.min.time())))
+            moon_times['transit'] = next((_to_dt(t) for t, y in zip(transits, upper) if y), None)
+        elif (highest_transit := timeline.highest_transit(search_start, search_end)) is not None: moon_times['transit'] = _to_dt(highest_transit)
         
-        def moon_above_45(t): return (eph['earth'] + observer).at(t).observe(eph['moon']).apparent().altaz()[0].degrees > 45.0
-        moon_above_45.step_days = 0.05
-        t_45, y_45 = almanac.find_discrete(search_start_ts, search_end_ts, moon_above_45)
+        t_45, y_45 = timeline.crossings_45(search_start, search_end)
         if moon_times['rise']: moon_times['ascent_45'] = next((_to_dt(t) for t, y in zip(t_45, y_45) if y and _to_dt(t) > moon_times['rise']), None)
         if moon_times['transit']: moon_times['descent_45'] = next((_to_dt(t) for t, y in zip(t_45, y_45) if not y and _to_dt(t) > moon_times['transit']), None)
     except Exception: pass
+    if own_day: return {k: v if v and v.date() == day_start.date() else None for k, v in moon_times.items()}
     return moon_times
 
-def calculate_inland_tides(eph, observer, ts, target_date, tz):
+def calculate_inland_tides(eph, observer, ts, target_date, tz, timeline=None):
     day_start = datetime(target_date.year, target_date.month, target_date.day, tzinfo=tz)
-    search_start_ts, search_end_ts = ts.from_datetime(day_start - timedelta(hours=12)), ts.from_datetime(day_start + timedelta(hours=36))
+    search_start, search_end = tide_search_window(target_date, tz)
     def _to_dt(t): return t.utc_datetime().replace(tzinfo=pytz.utc).astimezone(tz)
     
     tides = []
     try:
-        t_transits, _ = almanac.find_discrete(search_start_ts, search_end_ts, almanac.meridian_transits(eph, eph['moon'], observer))
+        if timeline is None or not timeline.covers(search_start, search_end): timeline = LunarTimeline(eph, observer, ts, search_start, search_end)
+        t_transits, _ = timeline.transits(search_start, search_end)
         high_tides = sorted([_to_dt(t) for t in t_transits])
         
         for i in range(len(high_tides) - 1):
@@ -284,53 +770,46 @@ def calculate_inland_tides(eph, observer, ts, target_date, tz):
 def format_time(dt_object): return dt_object.strftime('%I:%M %p') if dt_object else "Does not occur"
 def subpoint_of_body(eph, body, t):
     try:
-        lat, lon, _ = eph['earth'].at(t).observe(eph[body]).apparent().frame_latlon(itrs)
+        lat, lon, _ = eph['earth'].at(t).observe(eph[body]).apparent().frame_latlon(framelib.itrs)
         lon_deg = lon.degrees - 360 if lon.degrees > 180 else lon.degrees
         return lat.degrees, lon_deg
     except Exception: return None, None
-def analyze_sub_point_locations(target_lat, target_lon, eph, ts, body_name):
-    t0 = ts.now()
-    
-    visible_cities = []
-    for city_data in WORLD_CITIES:
-        city_obs = wgs84.latlon(city_data[2], city_data[3])
-        alt, _, _ = (eph['earth'] + city_obs).at(t0).observe(eph[body_name]).apparent().altaz()
-        if alt.degrees > 0:
-            visible_cities.append(city_data)
-    
-    if not visible_cities: visible_cities = WORLD_CITIES
+def body_altitudes(eph, body_name, t, latitudes, longitudes, topocentric=False, up=None):
+    """Altitudes in degrees of a body at time t for arrays of observers, from one geocentric observe() call.
 
-    closest = min(visible_cities, key=lambda c: haversine_km(target_lat, target_lon, c[2], c[3]))
-    
-    northern, southern = [c for c in visible_cities if c[2] > 0], [c for c in visible_cities if c[2] < 0]
+    The geocentric direction is dotted with each observer's WGS84 zenith; with topocentric=True the observer's
+    offset from the geocentre is subtracted first, which matters for the Moon's ~1° parallax.
+    """
+    body = eph['earth'].at(t).observe(eph[body_name]).apparent().frame_xyz(framelib.itrs).km
+    up = latlon_to_xyz(latitudes, longitudes) if up is None else up
+    if topocentric: body = body - skyfield_api.wgs84.latlon(latitudes, longitudes).itrs_xyz.km.T
+    return np.degrees(np.arcsin(np.clip(np.sum(up * body, axis=-1) / np.linalg.norm(body, axis=-1), -1.0, 1.0)))
+
+def analyze_sub_point_locations(target_lat, target_lon, eph, ts, body_name, index=None, topocentric=False, t=None):
+    index, t0 = index or get_city_index(), ts.now() if t is None else t
     
-    def get_influence_score(city, t_lat, t_lon):
-        dist = haversine_km(t_lat, t_lon, city[2], city[3])
-        return city[4] / (dist**2) if dist > 1 else float('inf')
-
-    def find_most_influenced(candidates, t_lat, t_lon, exclude=None):
-        if exclude:
-            candidates = [c for c in candidates if c[0] != exclude[0]]
-        if not candidates: return None
-        return max(candidates, key=lambda c: get_influence_score(c, t_lat, t_lon))
-
-    pop_n = find_most_influenced(northern, target_lat, target_lon)
-    if pop_n and pop_n[0] == closest[0]: # De-duplicate
-        pop_n = find_most_influenced(northern, target_lat, target_lon, exclude=pop_n)
-
-    pop_s = find_most_influenced(southern, target_lat, target_lon)
-    if pop_s and pop_s[0] == closest[0]: # De-duplicate
-        pop_s = find_most_influenced(southern, target_lat, target_lon, exclude=pop_s)
+    visible = body_altitudes(eph, body_name, t0, index.lat, index.lon, topocentric=topocentric, up=index.xyz) > 0
+    if not visible.any(): visible[:] = True
+
+    closest, _ = index.nearest(target_lat, target_lon, mask=visible)[0]
+
+    def find_most_influenced(mask):
+        city = index.most_influential(target_lat, target_lon, mask=mask)
+        if city and city.name == closest.name: # De-duplicate
+            city = index.most_influential(target_lat, target_lon, mask=mask, exclude=city.name)
+        return city
+
+    pop_n, pop_s = find_most_influenced(visible & (index.lat > 0)), find_most_influenced(visible & (index.lat < 0))
     
-    def format_city(city_data, t_lat, t_lon):
+    def format_city(city_data):
         if not city_data: return "N/A"
-        dist = haversine_km(t_lat, t_lon, city_data[2], city_data[3])
-        return f"{city_data[0]}, {city_data[1]} (~{int(dist)} km)"
+        dist = haversine_km(target_lat, target_lon, city_data.latitude, city_data.longitude)
+        return f"{city_data.name}, {city_data.country} (~{int(dist)} km)"
 
-    return {'nearest': format_city(closest, target_lat, target_lon), 'most_influenced_north': format_city(pop_n, target_lat, target_lon), 'most_influenced_south': format_city(pop_s, target_lat, target_lon)}
+    return {'nearest': format_city(closest), 'most_influenced_north': format_city(pop_n), 'most_influenced_south': format_city(pop_s)}
 
-def find_global_tide_locations(eph, ts):
-    t0 = ts.now()
+def find_global_tide_locations(eph, ts, t=None):
+    t0 = ts.now() if t is None else t
     moon_lat, moon_lon = subpoint_of_body(eph, 'moon', t0)
     sun_lat, sun_lon = subpoint_of_body(eph, 'sun', t0)
     
@@ -340,104 +819,606 @@ def find_global_tide_locations(eph, ts):
     
     def find_nearest_city_for_point(p_lat, p_lon):
         if p_lat is None: return None
-        closest = min(WORLD_CITIES, key=lambda c: haversine_km(p_lat, p_lon, c[2], c[3]))
-        return f"{closest[0]}, {closest[1]}"
+        closest, _ = get_city_index().nearest(p_lat, p_lon)[0]
+        return f"{closest.name}, {closest.country}"
 
     return {
         'high': list(filter(None, {find_nearest_city_for_point(lat, lon) for lat, lon in high_tide_points})),
         'low': list(filter(None, {find_nearest_city_for_point(lat, lon) for lat, lon in low_tide_points}))
     }
 
-if __name__ == "__main__":
-    mode = (LOCATION_MODE or "").strip().upper()
-    location = (get_location_by_ip() if mode == "AUTO" else get_location_by_coords(LATITUDE, LONGITUDE)) or get_location_by_address(CITY, STATE, COUNTRY)
-    if not location:
-        print("The cosmos remains veiled. Location could not be determined.")
-    else:
-        ts, eph = load.timescale(), None
-        try:
-            eph = load('de421.bsp')
-        except Exception:
-            print("Local de421.bsp not found. Attempting to download for future offline use...")
-            try: eph = load('de421.bsp')
-            except Exception as e: print(f"Warning: Could not download ephemeris ({e}). Moon and Tide data will be skipped.")
-        
-        observer = wgs84.latlon(location['latitude'], location['longitude'])
-        tz = pytz.timezone(location['timezone']); now = datetime.now(tz)
-        t0 = ts.from_datetime(now)
-        
-        print(f"\n--- Qibla-Numa Report for: {location['address']} at {now.strftime('%I:%M %p')} ---")
-        
-        sun_times = LocalPrayerCalculator(
-            latitude=location['latitude'], longitude=location['longitude'],
-            timezone_str=location['timezone'], madhab=MADHAB,
-            fajr_angle=PRAYER_METHOD_ANGLES['fajr'], isha_angle=PRAYER_METHOD_ANGLES['isha']
-        ).calculate_times_for_date(now)
+GRID_FIELDS = (("next_fajr", "f8"), ("next_maghrib", "f8"), ("moon_altitude", "f4"), ("tide_phase", "f4"))
+
+def grid_centres(resolution):
+    """Latitudes (north to south) and longitudes (west to east) of the cell centres of a global grid."""
+    rows, cols = int(round(180 / resolution)), int(round(360 / resolution))
+    return 90 - (np.arange(rows) + 0.5) * 180 / rows, -180 + (np.arange(cols) + 0.5) * 360 / cols
+
+def compute_global_grid(eph, ts, t, out, resolution=0.25, chunk_rows=90):
+    """Fills a (rows, cols) raster of GRID_FIELDS records for instant t, row 0 being the northernmost band of cells.
+
+    next_fajr and next_maghrib are Unix seconds (NaN where the Sun never reaches the angle in the next three days),
+    moon_altitude is topocentric degrees, and tide_phase is the fraction of the theoretical semidiurnal cycle since
+    the last high tide (0 under the Moon or its antipode, 0.5 at low tide). `out` is a path, written as a
+    memory-mapped .npy, or an existing array of the right shape; rows are computed chunk_rows at a time so memory
+    stays flat. Returns the array.
+    """
+    lats, lons = grid_centres(resolution)
+    grid = np.lib.format.open_memmap(out, mode="w+", dtype=np.dtype(list(GRID_FIELDS)), shape=(lats.size, lons.size)) if isinstance(out, (str, os.PathLike)) else out
+    instant = t.utc_datetime()
+    _, moon_lon = subpoint_of_body(eph, 'moon', t)
+    tide_phase = (((lons - moon_lon) % 180) / 180).astype(np.float32)
+    for start in range(0, lats.size, chunk_rows):
+        band = lats[start:start + chunk_rows]
+        prayers = BatchPrayerCalculator(band[:, None], lons[None, :], MADHAB, PRAYER_METHOD_ANGLES['fajr'], PRAYER_METHOD_ANGLES['isha']).next_times(instant, keys=("fajr", "maghrib"))
+        lat2d, lon2d = np.broadcast_arrays(band[:, None], lons[None, :])
+        rows = grid[start:start + band.size]
+        rows["next_fajr"], rows["next_maghrib"] = prayers["fajr"], prayers["maghrib"]
+        rows["moon_altitude"] = body_altitudes(eph, 'moon', t, lat2d.ravel(), lon2d.ravel(), topocentric=True).reshape(lat2d.shape)
+        rows["tide_phase"] = tide_phase
+    if isinstance(grid, np.memmap): grid.flush()
+    return grid
+
+class StageProfiler:
+    """Wall-clock spans for the report stages, with the skyfield .at()/.observe() calls made inside each.
+
+    Free unless enable() is called. Spans nest; each call counts toward the innermost open span only.
+    """
+    def __init__(self): self.enabled, self.spans, self._open, self._t0 = False, [], [], 0.0
+    def enable(self, count_calls=True):
+        self.enabled, self._t0 = True, time.perf_counter()
+        if count_calls:
+            with self.stage("skyfield import"): from skyfield import positionlib, vectorlib
+            for cls, attr in ((vectorlib.VectorFunction, "at"), (positionlib.Barycentric, "observe")): setattr(cls, attr, self._counting(getattr(cls, attr), attr))
+    def _counting(self, method, attr):
+        @functools.wraps(method)
+        def counted(*args, **kwargs):
+            if self._open: self._open[-1][attr] += 1
+            return method(*args, **kwargs)
+        return counted
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled: yield; return
+        span = {"name": name, "depth": len(self._open), "start": time.perf_counter() - self._t0, "seconds": 0.0, "at": 0, "observe": 0}
+        self._open.append(span)
+        try: yield
+        finally: span["seconds"] = time.perf_counter() - self._t0 - span["start"]; self._open.pop(); self.spans.append(span)
+    def table(self):
+        spans, total = sorted(self.spans, key=lambda s: s["start"]), sum(s["seconds"] for s in self.spans if s["depth"] == 0) or 1e-9
+        lines = [f"{'stage':<24} {'ms':>9} {'share':>6} {'.at()':>7} {'.observe()':>10}", "-" * 60]
+        lines += [f"{'  ' * s['depth'] + s['name']:<24} {s['seconds'] * 1e3:9.1f} {s['seconds'] / total:6.1%} {s['at']:7d} {s['observe']:10d}" for s in spans]
+        lines += ["-" * 60, f"{'total':<24} {total * 1e3:9.1f} {1:6.0%} {sum(s['at'] for s in spans):7d} {sum(s['observe'] for s in spans):10d}"]
+        return "\n".join(lines)
+    def write(self, path, fmt="chrome"):
+        """Writes the spans as a Chrome trace (chrome://tracing, Perfetto) or as a plain JSON list."""
+        events = [{"name": s["name"], "ph": "X", "ts": s["start"] * 1e6, "dur": s["seconds"] * 1e6, "pid": os.getpid(), "tid": 0,
+                   "args": {"at": s["at"], "observe": s["observe"]}} for s in self.spans]
+        with open(path, "w") as f: json.dump({"traceEvents": events, "displayTimeUnit": "ms"} if fmt == "chrome" else sorted(self.spans, key=lambda s: s["start"]), f, indent=1)
+
+PROFILER = StageProfiler()
+
+def load_ephemeris():
+    try:
+        return skyfield_api.load_file(EPHEMERIS_FILE) if os.path.exists(EPHEMERIS_FILE) else skyfield_api.load('de421.bsp')
+    except Exception:
+        print(f"Local {EPHEMERIS_FILE} not found. Attempting to download de421.bsp for future offline use...", file=sys.stderr)
+        try: return skyfield_api.load('de421.bsp')
+        except Exception as e: print(f"Warning: Could not download ephemeris ({e}). Moon and Tide data will be skipped.", file=sys.stderr)
+
+def extract_ephemeris(source, output, start_year, end_year, bodies=EPHEMERIS_BODIES):
+    """Writes to `output` a subset of the SPK kernel `source` covering the years start_year..end_year.
+
+    Only the segments that chain `bodies` back to the solar-system barycentre are kept. Returns the sizes of
+    source and output in bytes.
+    """
+    from jplephem.calendar import compute_julian_date
+    from jplephem.excerpter import write_excerpt
+    kernel = skyfield_api.load_file(source)
+    try:
+        pending, keep, chains = {kernel.decode(body) for body in bodies}, set(), {(s.target, s.center) for s in kernel.spk.segments}
+        while pending:
+            code = pending.pop()
+            for target, center in chains:
+                if target == code and (target, center) not in keep: keep.add((target, center)); pending.add(center)
+        summaries = [(name, values) for name, values in kernel.spk.daf.summaries() if (values[2], values[3]) in keep]
+        with open(output, "w+b") as f: write_excerpt(kernel.spk, f, compute_julian_date(start_year, 1, 1), compute_julian_date(end_year + 1, 1, 1), summaries)
+    finally: kernel.close()
+    return os.path.getsize(source), os.path.getsize(output)
+
+def location_providers():
+    """(name, provider(timeout)) pairs for LOCATION_MODE, most preferred first."""
+    first = ("ip", fetch_ip_location) if (LOCATION_MODE or "").strip().upper() == "AUTO" else ("coords", lambda timeout: get_location_by_coords(LATITUDE, LONGITUDE))
+    return [first, ("address", lambda timeout: lookup_address(CITY, STATE, COUNTRY, timeout))]
+
+def _in_daemon_thread(loop, fn, *args):
+    """Runs fn(*args) in a daemon thread and returns an asyncio future for it, so an abandoned lookup never holds up exit."""
+    future = loop.create_future()
+    def settle(result, error):
+        if not future.done(): future.set_exception(error) if error else future.set_result(result)
+    def work():
+        try: outcome = (fn(*args), None)
+        except Exception as e: outcome = (None, e)
+        try: loop.call_soon_threadsafe(settle, *outcome)
+        except RuntimeError: pass  # the resolver already returned and its loop is closed
+    threading.Thread(target=work, daemon=True).start()
+    return future
+
+async def resolve_location_async(providers, deadline, grace=None):
+    """Runs the location providers concurrently, each in its own thread with `deadline` as its timeout.
+
+    The earliest-listed provider with an answer wins, and the resolver returns as soon as no provider listed ahead of
+    it is still running. Once any provider has answered, those ahead of it get only `grace` seconds more (default
+    LOCATION_GRACE_SECONDS); then, or at the deadline, it takes the most preferred answer that has arrived. Returns
+    (location or None, stats), where stats names the winner and holds each provider's seconds (None if still running)
+    and the error it raised, if any.
+    """
+    finish_lazy_imports(np, requests)  # the IP lookup, the geocoder (through geopy) and TimezoneFinder all use them
+    loop = asyncio.get_running_loop()
+    start, stats = loop.time(), {"winner": None, "seconds": {name: None for name, _ in providers}, "errors": {}}
+    futures = [(name, _in_daemon_thread(loop, provider, deadline)) for name, provider in providers]
+    for name, future in futures: future.add_done_callback(lambda f, name=name: stats["seconds"].__setitem__(name, loop.time() - start))
+    def answered(future): return future.done() and future.exception() is None and future.result()
+
+    pending, location, cutoff = {f for _, f in futures}, None, deadline
+    while pending and location is None and (remaining := cutoff - (loop.time() - start)) > 0:
+        _, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        for name, future in futures:
+            if not future.done(): break  # a preferred provider may still answer
+            if answered(future): stats["winner"], location = name, future.result(); break
+        if location is None and cutoff == deadline and any(answered(f) for _, f in futures):
+            cutoff = min(deadline, loop.time() - start + (LOCATION_GRACE_SECONDS if grace is None else grace))
+    if location is None: stats["winner"], location = next(((name, f.result()) for name, f in futures if answered(f)), (None, None))
+    stats["errors"] = {name: f"{type(f.exception()).__name__}: {f.exception()}" for name, f in futures if f.done() and f.exception()}
+    return location, stats
+
+def resolve_location():
+    """Returns (location or None, stats) from resolve_location_async.
 
+    Outside AUTO mode, configured coordinates, a bundled city or an already geocoded address answer inline, without
+    asyncio or threads; only an address that needs the network goes through the resolver.
+    """
+    providers = location_providers()
+    if providers[0][0] == "coords":
+        t, seconds = time.perf_counter(), {}
+        for name, lookup in (("coords", lambda: get_location_by_coords(LATITUDE, LONGITUDE)), ("address", lambda: lookup_address(CITY, STATE, COUNTRY, offline=True))):
+            try: location = lookup()
+            except Exception: location = None
+            seconds[name] = time.perf_counter() - t
+            if location: return location, {"winner": name, "seconds": seconds, "errors": {}}
+    return asyncio.run(resolve_location_async(providers, LOCATION_DEADLINE_SECONDS))
+
+def format_resolution(stats):
+    timings = ", ".join(f"{name} {'still running' if sec is None else f'{sec * 1e3:.0f} ms'}" + (f" ({stats['errors'][name]})" if name in stats['errors'] else "") for name, sec in stats['seconds'].items())
+    return f"location: {stats['winner'] or 'no provider'} answered; {timings}"
+
+def get_next_event(events, now_time):
+    future = sorted([e for e in events if e['time'] > now_time], key=lambda x: x['time'])
+    return future[0] if future else None
+
+EVENT_SECTIONS = ("prayer", "moon", "tide", "phases")
+
+def events_expiry(events, now):
+    """When the next listed event, section validity window or local midnight passes."""
+    midnight = now.tzinfo.localize(datetime.combine(now.date() + timedelta(days=1), datetime.min.time()))
+    upcoming = [e['time'] for e in events['prayer'] + events['moon'] + events['tide']] + [date for _, date in events['phases']] + list(events['valid_until'].values()) + [midnight]
+    return min(t for t in upcoming if t > now)
+
+def search_moon_phases(eph, ts, now):
+    """The phase changes compute_events() looks at for `now`: its 35-day window plus a week. Only the instant matters, not the place."""
+    return almanac.find_discrete(ts.from_datetime(now), ts.from_datetime(now + timedelta(days=43)), almanac.moon_phases(eph))
+
+def compute_events(location, eph, ts, now, sections=EVENT_SECTIONS, phase_search=None):
+    """Runs the searches for `sections` (prayer, moon, tide, phases) at `now`; the others come back empty.
+
+    'valid_until' maps each computed section to when it goes stale: the moon and tide times at local midnight, the
+    prayer times then too or at UTC midnight if sooner (the calculator works from the UTC date), the phase list once
+    its next phase passes or a new one enters the 35-day window. 'expires' is events_expiry(). `phase_search` is
+    search_moon_phases() for the same instant, to share one search between many places.
+    """
+    tz = get_timezone(location['timezone'])
+    midnight = tz.localize(datetime.combine(now.date() + timedelta(days=1), datetime.min.time()))
+    prayer_events, moon_events, tide_events, phases, valid_until = [], [], [], [], {}
+    if 'prayer' in sections:
+        with PROFILER.stage("prayer calc"):
+            sun_times = LocalPrayerCalculator(
+                latitude=location['latitude'], longitude=location['longitude'],
+                timezone_str=location['timezone'], madhab=MADHAB,
+                fajr_angle=PRAYER_METHOD_ANGLES['fajr'], isha_angle=PRAYER_METHOD_ANGLES['isha']
+            ).calculate_times_for_date(now)
         prayer_events = [{'name': label, 'time': sun_times[key]} for key, label in {'fajr': 'Fajr', 'sunrise': 'Sunrise', 'dhuhr': 'Dhuhr', 'asr': 'Asr', 'maghrib': 'Maghrib', 'isha': 'Isha'}.items() if sun_times.get(key)]
-        moon_events, tide_events = [], []
-        
-        if eph:
-            moon_times = calculate_moon_mysteries(eph, observer, ts, t0, tz)
+        valid_until['prayer'] = min(midnight, pytz.utc.localize(datetime.combine(now.astimezone(pytz.utc).date() + timedelta(days=1), datetime.min.time())).astimezone(tz))
+
+    if eph and {'moon', 'tide', 'phases'} & set(sections):
+        observer, t0 = skyfield_api.wgs84.latlon(location['latitude'], location['longitude']), ts.from_datetime(now)
+        windows = (moon_search_window(t0, tz), tide_search_window(now.date(), tz))
+        timeline = LunarTimeline(eph, observer, ts, min(w[0] for w in windows), max(w[1] for w in windows))
+        if 'moon' in sections:
+            with PROFILER.stage("moon searches"): moon_times = calculate_moon_mysteries(eph, observer, ts, t0, tz, timeline)
             moon_events = [{'name': label, 'time': moon_times[key]} for key, label in {'rise': 'Moonrise', 'ascent_45': 'Ascent 45°', 'transit': 'Zenith', 'descent_45': 'Descent 45°', 'set': 'Moonset'}.items() if moon_times.get(key)]
-            tide_events = calculate_inland_tides(eph, observer, ts, now.date(), tz)
+            valid_until['moon'] = midnight
+        if 'tide' in sections:
+            with PROFILER.stage("tide searches"): tide_events = calculate_inland_tides(eph, observer, ts, now.date(), tz, timeline)
+            valid_until['tide'] = midnight
+        if 'phases' in sections:
+            # Search a week past the 35-day window so we also know when a new phase would slide into it.
+            def _to_dt(t): return t.utc_datetime().replace(tzinfo=pytz.utc).astimezone(tz)
+            window_end = now + timedelta(days=35)
+            with PROFILER.stage("phases"): phase_times, phase_vals = phase_search or timeline.phases(now, window_end + timedelta(days=8))
+            in_window = [(almanac.MOON_PHASES[pv], _to_dt(pt)) for pt, pv in zip(phase_times, phase_vals)]
+            phases = sorted(list({name: date for name, date in in_window if date <= window_end}.items()), key=lambda item: item[1])[:4]
+            horizon = [date - timedelta(days=35) for _, date in in_window if date > window_end][:1]
+            valid_until['phases'] = min([date for _, date in in_window if now < date <= window_end] + horizon, default=midnight)
 
-        def get_next_event(events, now_time):
-            future = sorted([e for e in events if e['time'] > now_time], key=lambda x: x['time'])
-            return future[0] if future else None
+    events = {'prayer': prayer_events, 'moon': moon_events, 'tide': tide_events, 'phases': phases, 'valid_until': valid_until}
+    events['expires'] = events_expiry(events, now)
+    return events
 
-        next_prayer_event = get_next_event(prayer_events, now)
-        next_moon_event = get_next_event(moon_events, now)
-        next_tide_event = get_next_event(tide_events, now)
-        
-        print("\n☀️ The Sun's Decree (Prayer Times)")
-        for event in prayer_events:
-            print(f" {'* ' if next_prayer_event and event['time'] == next_prayer_event['time'] else '  '}{event['name']:<10}: {format_time(event['time'])}")
-        
+TIMETABLE_FIELDS = ("date",) + PRAYER_KEYS + ("moonrise", "moon_ascent_45", "moon_transit", "moon_descent_45", "moonset", "tides", "moon_phase")
+
+def iter_timetable(location, eph, ts, start_date, end_date, chunk_days=366):
+    """Yields one row per local date from start_date to end_date inclusive, each as soon as it is computed.
+
+    Moon, tide and phase events come from one LunarTimeline per chunk of up to chunk_days days, so a year costs one
+    skyfield search per event family instead of one per day, while memory stays bounded however long the range.
+    Moon cells are empty on dates without that event. Without an ephemeris only the prayer columns are filled.
+    """
+    tz = get_timezone(location['timezone'])
+    calculator = LocalPrayerCalculator(location['latitude'], location['longitude'], location['timezone'], MADHAB, PRAYER_METHOD_ANGLES['fajr'], PRAYER_METHOD_ANGLES['isha'])
+    observer = skyfield_api.wgs84.latlon(location['latitude'], location['longitude']) if eph else None
+    def _to_dt(t): return t.utc_datetime().replace(tzinfo=pytz.utc).astimezone(tz)
+    def _midnight(d): return tz.localize(datetime.combine(d, datetime.min.time()))
+
+    day = start_date
+    while day <= end_date:
+        chunk = [day + timedelta(days=i) for i in range(min(chunk_days, (end_date - day).days + 1))]
+        timeline, phases = None, {}
         if eph:
-            print("\n🌙 The Moon's Mysteries (Local Time)")
-            for event in moon_events:
-                print(f" {'* ' if next_moon_event and event['time'] == next_moon_event['time'] else '  '}{event['name']:<12}: {format_time(event['time'])}")
-
-            if tide_events:
-                last_tide = max([t for t in tide_events if t['time'] <= now], key=lambda x: x['time'], default=None)
-                current_state = "Rising" if last_tide and last_tide['name'] == 'Low Tide' else "Falling"
-                print(f"\n🌊 Inland Tide (Theoretical) - Currently {current_state}")
-                for tide in tide_events:
-                    print(f" {'* ' if next_tide_event and tide['time'] == next_tide_event['time'] else '  '}{tide['name']:<12}: {format_time(tide['time'])}")
-
-            apparent = (eph['earth'] + observer).at(t0).observe(eph['moon']).apparent()
-            alt, az, distance = apparent.altaz()
-            print("\n   Current Moon:")
-            print(f"     Direction (azimuth): {az.degrees:.2f}°")
-            print(f"     Altitude:            {alt.degrees:.2f}°")
-            print(f"     Distance:            {distance.km:,.0f} km")
-            
-            def _to_dt(t): return t.utc_datetime().replace(tzinfo=pytz.utc).astimezone(tz)
-            phase_times, phase_vals = almanac.find_discrete(t0, ts.from_datetime(now + timedelta(days=35)), almanac.moon_phases(eph))
-            unique_phases = sorted(list({almanac.MOON_PHASES[pv]: _to_dt(pt) for pt, pv in zip(phase_times, phase_vals)}.items()), key=lambda item: item[1])
-            print('\n   Upcoming Primary Phases:')
-            if unique_phases:
-                for i, (name, date) in enumerate(unique_phases[:4]):
-                    print(f"   {'* ' if i == 0 else '  '}{name:<15}: {date.strftime('%b %d, %Y, %I:%M %p')}")
-
-            print('\nSub-point & Global Tide Summary:')
+            windows = [moon_search_window(ts.from_datetime(_midnight(d)), tz) for d in (chunk[0], chunk[-1])] + [tide_search_window(d, tz) for d in (chunk[0], chunk[-1])]
+            timeline = LunarTimeline(eph, observer, ts, min(w[0] for w in windows), max(w[1] for w in windows))
+            phase_times, phase_vals = timeline.phases(_midnight(chunk[0]), _midnight(chunk[-1] + timedelta(days=1)))
+            phases = {_to_dt(pt).date(): almanac.MOON_PHASES[pv] for pt, pv in zip(phase_times, phase_vals)}
+        for d in chunk:
+            row = dict.fromkeys(TIMETABLE_FIELDS)
+            row.update(date=d, **calculator.calculate_times_for_date(tz.localize(datetime.combine(d, datetime.min.time().replace(hour=12)))))
+            if timeline:
+                moon_times = calculate_moon_mysteries(eph, observer, ts, ts.from_datetime(_midnight(d)), tz, timeline, own_day=True)
+                row.update(moonrise=moon_times['rise'], moon_ascent_45=moon_times['ascent_45'], moon_transit=moon_times['transit'], moon_descent_45=moon_times['descent_45'], moonset=moon_times['set'])
+                row.update(tides=calculate_inland_tides(eph, observer, ts, d, tz, timeline), moon_phase=phases.get(d))
+            yield row
+        day = chunk[-1] + timedelta(days=1)
+
+def to_json_value(v):
+    """v with datetimes and dates as ISO 8601 strings, recursing into dicts, lists and tuples."""
+    if isinstance(v, dict): return {k: to_json_value(x) for k, x in v.items()}
+    if isinstance(v, (list, tuple)): return [to_json_value(x) for x in v]
+    if isinstance(v, datetime): return v.isoformat(timespec="seconds")
+    return v.isoformat() if hasattr(v, "isoformat") else v
+
+def write_timetable(rows, out, fmt="csv"):
+    """Writes timetable rows to the text stream `out` as CSV or JSON Lines, one line per row as it arrives; returns the row count."""
+    writer, count = csv.DictWriter(out, TIMETABLE_FIELDS) if fmt == "csv" else None, 0
+    if writer: writer.writeheader()
+    for count, row in enumerate(rows, 1):
+        row = to_json_value(row)
+        if writer: writer.writerow({**row, 'tides': "; ".join(f"{e['name']} {e['time']}" for e in row['tides'] or [])})
+        else: out.write(json.dumps(row, ensure_ascii=False) + "\n")
+    return count
+
+_FLEET_WORKER = {}
+
+def read_fleet(path):
+    """Yields one dict per row of a CSV file of sites, read lazily.
+
+    Each row needs either latitude and longitude (timezone optional) or city/state/country; other columns such as
+    a name or id are passed through to the output untouched.
+    """
+    with open(path, newline="", encoding="utf-8") as f: yield from csv.DictReader(f)
+
+def resolve_site(site, offline=False):
+    """A site's location from its coordinates, else its city; offline=True never calls the geocoder."""
+    lat, lon, tz_name = (str(site.get(k) or "").strip() for k in ("latitude", "longitude", "timezone"))
+    if lat and lon and tz_name: return {"latitude": float(lat), "longitude": float(lon), "timezone": tz_name, "address": f"Coordinates ({lat}, {lon})"}
+    return get_location_by_coords(lat, lon) or (get_location_by_address(site.get("city", ""), site.get("state", ""), site.get("country", ""), offline) if site.get("city") else None)
+
+def fleet_tasks(sites, now):
+    """(site, location, now) tasks for fleet_site_report.
+
+    Sites with only a city that is not bundled are geocoded here in the parent, rate-limited and through
+    LOCATION_CACHE, so each address is fetched at most once; the rest get location None and resolve offline in
+    their worker. The pool pulls tasks from a background thread, so geocoding overlaps the workers' computing.
+    """
+    for site in sites:
+        has_coords = all(str(site.get(k) or "").strip() for k in ("latitude", "longitude"))
+        needs_geocode = site.get("city") and not has_coords and find_city(site["city"], site.get("country", "")) is None
+        yield site, resolve_site(site) if needs_geocode else None, now
+
+def _init_fleet_worker():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is the parent's to handle
+    LOCATION_CACHE.reset()  # never share a SQLite connection inherited through fork
+    _FLEET_WORKER.update(ts=skyfield_api.load.timescale(), eph=load_ephemeris())
+
+def fleet_phase_search(now):
+    """search_moon_phases() for `now`, run once per worker and shared by all of its sites."""
+    if _FLEET_WORKER.get('phase_now') != now and _FLEET_WORKER['eph']:
+        _FLEET_WORKER.update(phase_now=now, phase_search=search_moon_phases(_FLEET_WORKER['eph'], _FLEET_WORKER['ts'], now))
+    return _FLEET_WORKER.get('phase_search')
+
+def fleet_site_report(task):
+    """The events for one site at the UTC instant `now`, as a JSON-ready dict; runs in a pool worker."""
+    site, location, now = task
+    try:
+        location = location or resolve_site(site, offline=True)
+        if not location: return {"site": site, "error": "location could not be determined"}
+        events = compute_events(location, _FLEET_WORKER['eph'], _FLEET_WORKER['ts'], now.astimezone(get_timezone(location['timezone'])), phase_search=fleet_phase_search(now))
+        return to_json_value({"site": site, "location": location, **events})
+    except Exception as e: return {"site": site, "error": f"{type(e).__name__}: {e}"}
+
+def run_fleet(sites, out, now, workers=None):
+    """Computes every site's events across a process pool and writes each as a JSON line as soon as it completes.
+
+    Every worker loads the timescale and ephemeris once in its initializer and reuses them for all its sites; sites
+    that need the geocoder are resolved by fleet_tasks in this process, never in a worker. Output order is completion
+    order. Returns (sites processed, elapsed seconds).
+    """
+    import multiprocessing
+    start, count = time.perf_counter(), 0
+    with multiprocessing.Pool(workers, initializer=_init_fleet_worker) as pool:
+        for count, result in enumerate(pool.imap_unordered(fleet_site_report, fleet_tasks(sites, now)), 1):
+            out.write(json.dumps(result, ensure_ascii=False) + "\n"); out.flush()
+    return count, time.perf_counter() - start
+
+def live_details(location, events, eph, ts, now):
+    """What the report works out afresh on every run: the next events, the tide trend, the current Moon and the sub-points."""
+    details = {'next': {name: get_next_event(events[name], now) for name in ('prayer', 'moon', 'tide')}}
+    last_tide = max([t for t in events['tide'] if t['time'] <= now], key=lambda x: x['time'], default=None)
+    details['tide_state'] = "Rising" if last_tide and last_tide['name'] == 'Low Tide' else "Falling"
+    if eph:
+        observer, t0 = skyfield_api.wgs84.latlon(location['latitude'], location['longitude']), ts.from_datetime(now)
+        with PROFILER.stage("current moon"): details['moon_altaz'] = (eph['earth'] + observer).at(t0).observe(eph['moon']).apparent().altaz()
+        with PROFILER.stage("sub-point analysis"):
             sun_lat, sun_lon = subpoint_of_body(eph, 'sun', t0)
             moon_lat, moon_lon = subpoint_of_body(eph, 'moon', t0)
-            sun_cities = analyze_sub_point_locations(sun_lat, sun_lon, eph, ts, 'sun') if sun_lat is not None else None
-            moon_cities = analyze_sub_point_locations(moon_lat, moon_lon, eph, ts, 'moon') if moon_lat is not None else None
-            global_tides = find_global_tide_locations(eph, ts)
-            
-            if sun_cities:
-                print(f"  Sun Zenith:  {sun_lat:.2f}, {sun_lon:.2f} | Nearest: {sun_cities['nearest']}")
-                print(f"    > Most Influenced (North): {sun_cities['most_influenced_north']}")
-                print(f"    > Most Influenced (South): {sun_cities['most_influenced_south']}")
-            if moon_cities:
-                print(f"\n  Moon Zenith: {moon_lat:.2f}, {moon_lon:.2f} | Nearest: {moon_cities['nearest']}")
-                print(f"    > Most Influenced (North): {moon_cities['most_influenced_north']}")
-                print(f"    > Most Influenced (South): {moon_cities['most_influenced_south']}")
-            
-            print("\n  Global High Tides Near: " + ", ".join(global_tides['high']))
-            print("  Global Low Tides Near:  " + ", ".join(global_tides['low']))
-        else: print("\n🌙 Moon and Tide data unavailable (ephemeris file not found).")
-        print("-" * 45)
\ No newline at end of file
+            details['sun_zenith'] = (sun_lat, sun_lon, analyze_sub_point_locations(sun_lat, sun_lon, eph, ts, 'sun') if sun_lat is not None else None)
+            details['moon_zenith'] = (moon_lat, moon_lon, analyze_sub_point_locations(moon_lat, moon_lon, eph, ts, 'moon') if moon_lat is not None else None)
+            details['global_tides'] = find_global_tide_locations(eph, ts)
+    return details
+
+def render_report(location, events, eph, ts, now, prayers_only=False, details=None):
+    """Renders the report text; the current Moon and sub-point lines come from live_details() for `now`."""
+    if details is None: details = live_details(location, events, eph, ts, now)
+    next_prayer_event, next_moon_event, next_tide_event = (details['next'][name] for name in ('prayer', 'moon', 'tide'))
+
+    lines = [f"\n--- Qibla-Numa Report for: {location['address']} at {now.strftime('%I:%M %p')} ---"]
+    lines.append("\n☀️ The Sun's Decree (Prayer Times)")
+    for event in events['prayer']:
+        lines.append(f" {'* ' if next_prayer_event and event['time'] == next_prayer_event['time'] else '  '}{event['name']:<10}: {format_time(event['time'])}")
+
+    if eph:
+        lines.append("\n🌙 The Moon's Mysteries (Local Time)")
+        for event in events['moon']:
+            lines.append(f" {'* ' if next_moon_event and event['time'] == next_moon_event['time'] else '  '}{event['name']:<12}: {format_time(event['time'])}")
+
+        if events['tide']:
+            lines.append(f"\n🌊 Inland Tide (Theoretical) - Currently {details['tide_state']}")
+            for tide in events['tide']:
+                lines.append(f" {'* ' if next_tide_event and tide['time'] == next_tide_event['time'] else '  '}{tide['name']:<12}: {format_time(tide['time'])}")
+
+        alt, az, distance = details['moon_altaz']
+        lines.append("\n   Current Moon:")
+        lines.append(f"     Direction (azimuth): {az.degrees:.2f}°")
+        lines.append(f"     Altitude:            {alt.degrees:.2f}°")
+        lines.append(f"     Distance:            {distance.km:,.0f} km")
+
+        lines.append('\n   Upcoming Primary Phases:')
+        for i, (name, date) in enumerate(events['phases']):
+            lines.append(f"   {'* ' if i == 0 else '  '}{name:<15}: {date.strftime('%b %d, %Y, %I:%M %p')}")
+
+        lines.append('\nSub-point & Global Tide Summary:')
+        (sun_lat, sun_lon, sun_cities), (moon_lat, moon_lon, moon_cities) = details['sun_zenith'], details['moon_zenith']
+        if sun_cities:
+            lines.append(f"  Sun Zenith:  {sun_lat:.2f}, {sun_lon:.2f} | Nearest: {sun_cities['nearest']}")
+            lines.append(f"    > Most Influenced (North): {sun_cities['most_influenced_north']}")
+            lines.append(f"    > Most Influenced (South): {sun_cities['most_influenced_south']}")
+        if moon_cities:
+            lines.append(f"\n  Moon Zenith: {moon_lat:.2f}, {moon_lon:.2f} | Nearest: {moon_cities['nearest']}")
+            lines.append(f"    > Most Influenced (North): {moon_cities['most_influenced_north']}")
+            lines.append(f"    > Most Influenced (South): {moon_cities['most_influenced_south']}")
+
+        lines.append("\n  Global High Tides Near: " + ", ".join(details['global_tides']['high']))
+        lines.append("  Global Low Tides Near:  " + ", ".join(details['global_tides']['low']))
+    elif not prayers_only: lines.append("\n🌙 Moon and Tide data unavailable (ephemeris file not found).")
+    lines.append("-" * 45)
+    return "\n".join(lines)
+
+def report_summary(events, details):
+    """The report's headline values as strings, to compare with the last run's; city distances are left out."""
+    def _city(text): return text.rsplit(" (~", 1)[0]
+    def _next(e): return f"{e['name']} at {format_time(e['time'])}" if e else "None today"
+    summary = {e['name']: format_time(e['time']) for e in events['prayer'] + events['moon']}
+    summary['Next prayer'] = _next(details['next']['prayer'])
+    if 'moon_altaz' not in details: return summary
+    summary['Next moon event'] = _next(details['next']['moon'])
+    if events['tide']:
+        summary['Tides'] = ", ".join(f"{t['name']} {format_time(t['time'])}" for t in events['tide'])
+        summary['Inland tide'] = f"{details['tide_state']}, next: {_next(details['next']['tide'])}"
+    if events['phases']: summary['Next phase'] = f"{events['phases'][0][0]} on {events['phases'][0][1].strftime('%b %d, %I:%M %p')}"
+    for key, label in (('sun_zenith', 'Sun zenith'), ('moon_zenith', 'Moon zenith')):
+        cities = details[key][2]
+        if cities: summary[label] = f"near {_city(cities['nearest'])} (north: {_city(cities['most_influenced_north'])}, south: {_city(cities['most_influenced_south'])})"
+    summary['Global high tides'] = "; ".join(sorted(details['global_tides']['high']))
+    summary['Global low tides'] = "; ".join(sorted(details['global_tides']['low']))
+    return summary
+
+PRAYER_SUMMARY_KEYS = ("Fajr", "Sunrise", "Dhuhr", "Asr", "Maghrib", "Isha", "Next prayer")
+
+def merge_summary(old, summary, sky_shown):
+    """The summary to save: this run's, keeping the old Moon and tide lines only when this run (--prayers) did not render them."""
+    if sky_shown or not old: return summary
+    return {**{k: v for k, v in old.items() if k not in PRAYER_SUMMARY_KEYS}, **summary}
+
+def summary_changes(old, summary, sky_shown):
+    """One line per value that differs from `old`, including lines of a rendered section that no longer appear."""
+    changed = [f"  {key}: {value} (was {old.get(key, 'not shown')})" for key, value in summary.items() if old.get(key) != value]
+    return changed + [f"  {key}: no longer occurs (was {value})" for key, value in old.items() if key not in summary and (sky_shown or key in PRAYER_SUMMARY_KEYS)]
+
+def report_state_key(location):
+    """Saved events are only reused for the same place, prayer method and ephemeris."""
+    return json.dumps([round(location['latitude'], 4), round(location['longitude'], 4), location['timezone'], MADHAB, PRAYER_METHOD_ANGLES, EPHEMERIS_FILE])
+
+def load_report_state(path, location):
+    """The events and summary save_report_state() wrote for this location, or None when there are none to reuse."""
+    if not path: return None
+    try:
+        with open(path, encoding="utf-8") as f: state = json.load(f)
+        if state.get('key') != report_state_key(location): return None
+        tz = get_timezone(location['timezone'])
+        def _dt(s): return datetime.fromisoformat(s).astimezone(tz)
+        saved = state['events']
+        events = {name: [{'name': e['name'], 'time': _dt(e['time'])} for e in saved[name]] for name in ('prayer', 'moon', 'tide')}
+        events['phases'] = [(name, _dt(date)) for name, date in saved['phases']]
+        events['valid_until'] = {name: _dt(t) for name, t in saved['valid_until'].items()}
+        return {'events': events, 'summary': state['summary'], 'saved': _dt(state['saved'])}
+    except (OSError, ValueError, KeyError, TypeError, AttributeError): return None
+
+def save_report_state(path, location, events, summary, now):
+    """Writes the events and report summary for the next run; replaced atomically so a concurrent launch never reads half a file."""
+    if not path: return
+    state = {'key': report_state_key(location), 'saved': now, 'events': {k: v for k, v in events.items() if k != 'expires'}, 'summary': summary}
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f: json.dump(to_json_value(state), f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Warning: could not save the report state ({e}).", file=sys.stderr)
+        if os.path.exists(tmp): os.unlink(tmp)
+
+def incremental_events(location, eph, ts, now, state):
+    """compute_events() for only the sections of the saved state that have expired (or were never computed)."""
+    cached = state['events'] if state else {'valid_until': {}}
+    stale = tuple(name for name in EVENT_SECTIONS if now >= cached['valid_until'].get(name, now))
+    fresh = compute_events(location, eph, ts, now, stale) if stale else {'valid_until': {}}
+    events = {name: fresh[name] if name in stale else cached[name] for name in EVENT_SECTIONS}
+    events['valid_until'] = {**{k: v for k, v in cached['valid_until'].items() if k not in stale}, **fresh['valid_until']}
+    events['expires'] = events_expiry(events, now)
+    return events
+
+class ReportDaemon:
+    """Keeps the timescale, ephemeris and location in memory and serves the rendered report over a Unix socket.
+
+    The event searches rerun only once the next listed event or local midnight has passed; the header clock,
+    current Moon and sub-point lines are re-rendered once a minute. Clients get the last rendered text at once.
+    """
+    def __init__(self, location, ts, eph):
+        self.location, self.ts, self.eph, self.tz = location, ts, eph, get_timezone(location['timezone'])
+        self.events, self.report, self.lock = None, "", threading.Lock()
+    def refresh(self):
+        now = datetime.now(self.tz)
+        if self.events is None or now >= self.events['expires']: self.events = compute_events(self.location, self.eph, self.ts, now)
+        report = render_report(self.location, self.events, self.eph, self.ts, now) + "\n"
+        with self.lock: self.report = report
+        return min(self.events['expires'], (now + timedelta(minutes=1)).replace(second=0, microsecond=0))
+    def _refresh_loop(self, expires):
+        while True:
+            time.sleep(max(0.0, (expires - datetime.now(self.tz)).total_seconds()))
+            try: expires = self.refresh()
+            except Exception as e:
+                print(f"Warning: report refresh failed ({e}); retrying in a minute.", file=sys.stderr)
+                expires = datetime.now(self.tz) + timedelta(minutes=1)
+    def serve(self, socket_path):
+        if os.path.exists(socket_path):
+            if fetch_report(socket_path) is not None:
+                print(f"A Qibla-Numa daemon is already listening on {socket_path}."); return
+            os.unlink(socket_path)
+        expires = self.refresh()
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server.bind(socket_path); os.chmod(socket_path, 0o600); server.listen(16)
+            threading.Thread(target=self._refresh_loop, args=(expires,), daemon=True).start()
+            print(f"Qibla-Numa daemon serving {self.location['address']} on {socket_path}")
+            while True:
+                conn, _ = server.accept()
+                with conn, self.lock: conn.sendall(self.report.encode("utf-8"))
+        except KeyboardInterrupt: pass
+        finally:
+            server.close()
+            if os.path.exists(socket_path): os.unlink(socket_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Qibla-Numa: prayer times, moon, tides and sub-points for your location.")
+    parser.add_argument("--daemon", action="store_true", help=f"keep everything loaded and serve the report on {DAEMON_SOCKET} (read it with try_client.py)")
+    parser.add_argument("--prayers", action="store_true", help="print only the Sun's Decree (prayer times); skips skyfield and the ephemeris")
+    parser.add_argument("--timetable", nargs=2, metavar=("START", "END"), type=lambda s: datetime.strptime(s, "%Y-%m-%d").date(), help="write a daily timetable for the dates START..END (YYYY-MM-DD, inclusive); with --prayers, prayer times only")
+    parser.add_argument("--format", choices=("csv", "jsonl"), default="csv", help="timetable output format (default: csv)")
+    parser.add_argument("--output", metavar="FILE", help="timetable or fleet output file (default: stdout)")
+    parser.add_argument("--fleet", metavar="CSV", help="write the events for every site in CSV (latitude,longitude[,timezone] or city,state,country columns) as JSON lines")
+    parser.add_argument("--workers", type=int, help="worker processes for --fleet (default: one per CPU)")
+    parser.add_argument("--extract-ephemeris", metavar="BSP", help=f"write a subset of {EPHEMERIS_FILE} with only EPHEMERIS_BODIES for --years")
+    parser.add_argument("--years", nargs=2, type=int, metavar=("START", "END"), help="years kept by --extract-ephemeris, inclusive (default: last year to 30 years ahead)")
+    parser.add_argument("--build-city-store", nargs=2, metavar=("CSV", "STORE"), help="convert a gazetteer CSV (name,country,latitude,longitude,population) into a city store for CITY_STORE_FILE")
+    parser.add_argument("--grid", metavar="NPY", help="write a global raster of next Fajr/Maghrib, Moon altitude and tide phase for now to NPY (a structured .npy; see compute_global_grid)")
+    parser.add_argument("--resolution", type=float, default=0.25, help="--grid cell size in degrees (default: 0.25)")
+    parser.add_argument("--changes", action="store_true", help="print only what changed since the last report (the full report on the first run)")
+    parser.add_argument("--profile", action="store_true", help="time each stage of the report and count skyfield .at()/.observe() calls; the table goes to stderr")
+    parser.add_argument("--profile-output", metavar="FILE", help="also write the profile spans to FILE (implies --profile)")
+    parser.add_argument("--profile-format", choices=("chrome", "json"), default="chrome", help="--profile-output format: a Chrome trace for chrome://tracing or Perfetto, or plain JSON (default: chrome)")
+    args = parser.parse_args()
+
+    if args.extract_ephemeris:
+        start_year, end_year = args.years or (datetime.now().year - 1, datetime.now().year + 30)
+        before, after = extract_ephemeris(EPHEMERIS_FILE, args.extract_ephemeris, start_year, end_year)
+        print(f"Wrote {args.extract_ephemeris}: {len(EPHEMERIS_BODIES)} bodies for {start_year}-{end_year}, {after / 1e6:.1f} MB (from {before / 1e6:.1f} MB)"); return
+
+    if args.build_city_store:
+        with open(args.build_city_store[0], newline="", encoding="utf-8") as f:
+            store = CityStore.from_rows((r["name"], r["country"], float(r["latitude"]), float(r["longitude"]), float(r["population"] or 0)) for r in csv.DictReader(f))
+        store = CityStore({**store.columns, **CityIndex(store).tree_columns()})
+        store.save(args.build_city_store[1])
+        print(f"Wrote {args.build_city_store[1]}: {len(store)} cities, {os.path.getsize(args.build_city_store[1]) / 1e6:.1f} MB"); return
+
+    if args.grid:
+        ts, eph = skyfield_api.load.timescale(), load_ephemeris()
+        if eph is None: return
+        start, t = time.perf_counter(), ts.now()
+        grid = compute_global_grid(eph, ts, t, args.grid, args.resolution)
+        print(f"Wrote {args.grid}: {grid.shape[0]} x {grid.shape[1]} cells at {args.resolution}° for {t.utc_strftime('%Y-%m-%d %H:%M UTC')} in {time.perf_counter() - start:.1f} s"); return
+
+    if args.fleet:
+        with (open(args.output, "w", encoding="utf-8") if args.output else contextlib.nullcontext(sys.stdout)) as out:
+            count, elapsed = run_fleet(read_fleet(args.fleet), out, datetime.now(pytz.utc), args.workers)
+        print(f"{count} locations in {elapsed:.1f} s ({count / elapsed:.1f} locations/s, {args.workers or os.cpu_count()} workers)", file=sys.stderr)
+        return
+
+    if args.profile or args.profile_output: PROFILER.enable(count_calls=not args.prayers)
+    with PROFILER.stage("location lookup"): location, resolution = resolve_location()
+    if PROFILER.enabled or not location: print(format_resolution(resolution), file=sys.stderr)
+    if not location:
+        print("The cosmos remains veiled. Location could not be determined."); return
+    if args.timetable:
+        ts, eph = (None, None) if args.prayers else (skyfield_api.load.timescale(), load_ephemeris())
+        with (open(args.output, "w", newline="", encoding="utf-8") if args.output else contextlib.nullcontext(sys.stdout)) as out:
+            write_timetable(iter_timetable(location, eph, ts, *args.timetable), out, args.format)
+        return
+    if args.prayers: ts, eph = None, None
+    else:
+        with PROFILER.stage("ephemeris load"): ts, eph = skyfield_api.load.timescale(), load_ephemeris()
+    if args.daemon and not args.prayers:
+        ReportDaemon(location, ts, eph).serve(DAEMON_SOCKET); return
+    now = datetime.now(get_timezone(location['timezone']))
+    state = load_report_state(REPORT_STATE_FILE, location)
+    with PROFILER.stage("events"): events = incremental_events(location, eph, ts, now, state)
+    with PROFILER.stage("render"):
+        details = live_details(location, events, eph, ts, now)
+        summary, sky_shown = report_summary(events, details), 'moon_altaz' in details
+        if args.changes and state:
+            changed, since = summary_changes(state['summary'], summary, sky_shown), state['saved'].strftime('%b %d, %I:%M %p')
+            report = "\n".join([f"Changes since {since}:"] + changed) if changed else f"Nothing has changed since {since}."
+        else: report = render_report(location, events, eph, ts, now, prayers_only=args.prayers, details=details)
+    print(report)
+    save_report_state(REPORT_STATE_FILE, location, events, merge_summary(state['summary'] if state else {}, summary, sky_shown), now)
+    if PROFILER.enabled:
+        print(PROFILER.table(), file=sys.stderr)
+        if args.profile_output: PROFILER.write(args.profile_output, args.profile_format)
+
+if __name__ == "__main__":
+    main()
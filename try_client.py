@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""Thin client for the Qibla-Numa daemon (`try.py --daemon`).
+
+Prints the report the daemon has already rendered. When no daemon is listening, or when
+command-line options are given, it runs try.py in its place (as a module, so its bytecode is
+cached), so it is always safe to call from a shell profile. Standard library only, so that it
+starts in a few milliseconds.
+"""
+
+import os
+import runpy
+import socket
+import sys
+
+DAEMON_SOCKET = os.path.join(os.environ.get("XDG_RUNTIME_DIR") or os.environ.get("TMPDIR") or "/tmp", f"qibla-numa-{os.getuid()}.sock")
+
+def fetch_report(socket_path=DAEMON_SOCKET, timeout=2.0):
+    """Returns the daemon's current report, or None when no daemon answers on socket_path."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout); sock.connect(socket_path)
+            chunks = []
+            while chunk := sock.recv(65536): chunks.append(chunk)
+        return b"".join(chunks).decode("utf-8") or None
+    except OSError: return None
+
+if __name__ == "__main__":
+    report = None if sys.argv[1:] else fetch_report()
+    if report is not None: sys.stdout.write(report)
+    else:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        runpy.run_module("try", run_name="__main__", alter_sys=True)